@@ -5,10 +5,12 @@ from os import environ
 from dotenv import load_dotenv
 import logging
 import asyncio
+from typing import Awaitable, Callable
 
-from utils.configuration import PREFIX, INTENTS, COMMAND_SYNC_FLAGS
+from utils.configuration import PREFIX, INTENTS, COMMAND_SYNC_FLAGS, GUILD_DATA_PRELOAD, GUILD_DATA_PRELOAD_MEMORY_BUDGET, ROLE_QUEUE_RATE, ROLE_QUEUE_PER
 from utils.database import Database
 from utils.guild_data import GuildData
+from utils.role_queue import RoleMutationQueue
 
 
 
@@ -22,6 +24,8 @@ class BotBase(commands.AutoShardedBot):
         self.boot_time = disnake.utils.utcnow()
         self.database = Database(self.env, self.loop)
         self.guild_data = GuildData(self.database)
+        self.role_queue = RoleMutationQueue(self, ROLE_QUEUE_RATE, ROLE_QUEUE_PER)
+        self.shutdown_hooks: list[Callable[[], Awaitable[None]]] = [self.role_queue.close]
         
         # Khởi tạo
         super().__init__(
@@ -36,8 +40,18 @@ class BotBase(commands.AutoShardedBot):
         self.logger.info(f"Khởi tạo thành công! Đã đăng nhập với tên {self.user.name} (UID: {self.user.id})")
 
     
+    async def prepare(self) -> None:
+        # Chạy trước khi đăng nhập, tức là trước on_ready
+        if not await self.database.wait_until_ready(): return
+        await self.guild_data.load_reaction_role_routes()
+        await self.guild_data.load_wordchain_channels()
+        if GUILD_DATA_PRELOAD: await self.guild_data.preload(GUILD_DATA_PRELOAD_MEMORY_BUDGET)
+
     async def on_close(self):
-        await self.database.connection.close()
+        for hook in self.shutdown_hooks:
+            try: await hook()
+            except Exception as e: self.logger.error("Đã có lỗi xảy ra khi thực hiện tác vụ trước khi dừng bot\n" + repr(e))
+        await self.database.close()
 
     def run(self) -> None:
         # Đăng nhập
@@ -45,11 +59,13 @@ class BotBase(commands.AutoShardedBot):
         if token is None: raise EnvironmentError("Bot token chưa được cài đặt trong biến môi trường")
         
         async def runner() -> None:
-            try: await self.start(token)
+            try:
+                await self.prepare()
+                await self.start(token)
             finally:
                 self.logger.info("Đang thực hiện các tác vụ trước khi dừng bot")
                 if not self.is_closed(): await self.close()
-                await self.database.close()
+                await self.on_close()
                 await self.loop.shutdown_asyncgens()
         
         def stop_loop_on_completion(f) -> None: 
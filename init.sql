@@ -25,4 +25,26 @@ CREATE TABLE IF NOT EXISTS `member_xp` (
     `user_id` BIGINT NOT NULL UNIQUE,
     `xp` BIGINT NOT NULL DEFAULT 0,
     PRIMARY KEY(`user_id`)
-);
\ No newline at end of file
+);
+
+CREATE TABLE IF NOT EXISTS `wordchain_state` (
+    `guild_id` BIGINT NOT NULL UNIQUE,
+    `previous_last_character` VARCHAR(1) NOT NULL DEFAULT '',
+    `previous_player_id` BIGINT NOT NULL DEFAULT 0,
+    `used_words` MEDIUMBLOB DEFAULT NULL,
+    `used_letter_counts` TEXT DEFAULT NULL,
+    `snapshot_word_id` BIGINT NOT NULL DEFAULT 0,
+    `dictionary_version` VARCHAR(64) DEFAULT NULL,
+    PRIMARY KEY(`guild_id`)
+);
+
+CREATE TABLE IF NOT EXISTS `wordchain_words` (
+    `id` BIGINT NOT NULL AUTO_INCREMENT UNIQUE,
+    `guild_id` BIGINT NOT NULL,
+    `word` VARCHAR(64) NOT NULL,
+    `channel_id` BIGINT NOT NULL,
+    `message_id` BIGINT NOT NULL,
+    PRIMARY KEY(`id`)
+);
+
+CREATE INDEX `idx_wordchain_guild_id` ON `wordchain_words` (`guild_id`, `id`);
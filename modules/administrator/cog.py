@@ -1,23 +1,39 @@
 from botbase import BotBase
-from utils.configuration import MASTER_GUILD_ID, EPHEMERAL_AUDIT_ACTION, EPHEMERAL_ERROR_ACTION
+from utils.configuration import MASTER_GUILD_ID, EPHEMERAL_AUDIT_ACTION, EPHEMERAL_ERROR_ACTION, CACHE_STATISTICS_LOG_INTERVAL
 from utils.guild_data import GuildData, ReactionRoleMessageEntity
+from utils.cache import CACHE_REGISTRY
+from utils.locks import LOCK_REGISTRY
+from utils.database import Database
 
 import disnake
-from disnake.ext import commands
+from disnake.ext import commands, tasks
 
 import logging
-import emoji
-import re
 
-DISCORD_EMOJI_PATTERN =  re.compile(r'<a?:.+?:\d{18,20}>')
+from .emoji_parser import parse_emoji, parse_partial_emoji
 
-def parse_emoji(text: str) -> str | None:
-    # if text is emoji return unique ID, None otherwise
-    text = text.strip()
-    if DISCORD_EMOJI_PATTERN.fullmatch(text) is not None: return text.split(":")[-1][: -1]
-    elif emoji.is_emoji(text):
-        return emoji.demojize(text)[1 : -1]
-    else: return None
+
+def format_cache_statistics() -> str:
+    lines = []
+    for name, cache in sorted(CACHE_REGISTRY.items()):
+        stats = cache.statistics()
+        lines.append(
+            f"{name}: {stats['size']}/{stats['capacity']} (max {stats['high_water']}) | "
+            f"hit {stats['hits']} | miss {stats['misses']} (expired {stats['expired_misses']}) | "
+            f"evict {stats['evictions']} | hit rate {stats['hit_rate'] * 100:.1f}%"
+        )
+    return "\n".join(lines)
+
+
+def format_pool_statistics(database: Database) -> str:
+    stats = database.statistics
+    pool = database.pool
+    connections = f"{pool.size - pool.freesize}/{pool.size} đang dùng" if pool is not None else "chưa kết nối"
+    return (
+        f"pool {database.pool_minsize} - {database.pool_maxsize}: {connections} | lấy kết nối {stats.acquired} | "
+        f"chờ trung bình {stats.average_wait * 1000:.1f} ms | tối đa {stats.max_wait * 1000:.1f} ms | "
+        f"quá thời gian {stats.timeouts}"
+    )
         
 
 class AdminCommands(commands.Cog):
@@ -25,35 +41,44 @@ class AdminCommands(commands.Cog):
         self.bot: BotBase = bot
         self.logger: logging.Logger = logging.getLogger(__name__)
         self.guild_data: GuildData = bot.guild_data
+        self.log_cache_statistics.start()
+
+    def cog_unload(self):
+        self.log_cache_statistics.cancel()
+
+    @tasks.loop(seconds=CACHE_STATISTICS_LOG_INTERVAL)
+    async def log_cache_statistics(self):
+        # Bỏ qua lần chạy ngay khi khởi động vì chưa có dữ liệu
+        if self.log_cache_statistics.current_loop == 0: return
+        self.logger.info("Thống kê bộ nhớ đệm:\n" + format_cache_statistics())
+        self.logger.info("Thống kê kết nối cơ sở dữ liệu: " + format_pool_statistics(self.bot.database))
         
+    async def __resolve_reaction_role__(self, event: disnake.RawReactionActionEvent) -> int | None:
+        if event.guild_id is None: return None
+        if self.guild_data.reaction_role_routes is not None:
+            # Loại bỏ các tin nhắn không cấp vai trò trước khi xử lí emoji
+            route = self.guild_data.get_reaction_role_route(event.message_id)
+            if route is None or route.guild_id != event.guild_id: return None
+        else:
+            guild_entity = await self.guild_data.get_guild_view(event.guild_id)
+            if event.message_id not in guild_entity.reaction_role_messages: return None
+            route = await self.guild_data.get_guild_reaction_role_message_view(event.message_id, event.guild_id)
+        parsed_emoji = parse_partial_emoji(event.emoji)
+        if parsed_emoji is None: return None
+        return route.map.get(parsed_emoji)
+
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, event: disnake.RawReactionActionEvent):
-        if event.guild_id is None: return
-        parsed_emoji = parse_emoji(event.emoji.__str__())
-        if parsed_emoji is None: return
-        guild_entity = await self.guild_data.get_guild(event.guild_id)
-        if event.message_id not in guild_entity.reaction_role_messages: return
-        reaction_role_message = await self.guild_data.get_guild_reaction_role_message(event.message_id, event.guild_id)
-        try: 
-            role_id = reaction_role_message.map[parsed_emoji]
-            await self.bot.http.add_role(event.guild_id, event.user_id, role_id)
-        except KeyError: return
-        except: self.logger.warning(f"(ID máy chủ {event.guild_id}): Không thể cấp vai trò {role_id} cho {event.user_id}")
+        role_id = await self.__resolve_reaction_role__(event)
+        if role_id is None: return
+        self.bot.role_queue.add_role(event.guild_id, event.user_id, role_id)
     
     
     @commands.Cog.listener()
     async def on_raw_reaction_remove(self, event: disnake.RawReactionActionEvent):
-        if event.guild_id is None: return
-        parsed_emoji = parse_emoji(event.emoji.__str__())
-        if parsed_emoji is None: return
-        guild_entity = await self.guild_data.get_guild(event.guild_id)
-        if event.message_id not in guild_entity.reaction_role_messages: return
-        reaction_role_message = await self.guild_data.get_guild_reaction_role_message(event.message_id, event.guild_id)
-        try: 
-            role_id = reaction_role_message.map[parsed_emoji]
-            await self.bot.http.remove_role(event.guild_id, event.user_id, role_id)
-        except KeyError: return
-        except: self.logger.warning(f"(ID máy chủ {event.guild_id}): Không thể xoá vai trò {role_id} cho {event.user_id}")
+        role_id = await self.__resolve_reaction_role__(event)
+        if role_id is None: return
+        self.bot.role_queue.remove_role(event.guild_id, event.user_id, role_id)
         
         
         
@@ -167,3 +192,52 @@ class AdminCommands(commands.Cog):
         self.logger.warning(f"Lệnh tắt được thực thi bởi @{inter.author.name} (UID: {inter.author.id})")
         await inter.response.send_message("⚠️ Đang tắt bot", ephemeral=EPHEMERAL_AUDIT_ACTION)
         await self.bot.close()
+
+    @system.sub_command(
+        name="cache",
+        description="Xem thống kê bộ nhớ đệm"
+    )
+    @commands.is_owner()
+    async def cache_statistics(self, inter: disnake.ApplicationCommandInteraction):
+        await inter.response.send_message(f"```\n{format_cache_statistics() or 'Không có dữ liệu'}\n```", ephemeral=True)
+
+    @system.sub_command(
+        name="database",
+        description="Xem thống kê pool kết nối cơ sở dữ liệu"
+    )
+    @commands.is_owner()
+    async def database_statistics(self, inter: disnake.ApplicationCommandInteraction):
+        await inter.response.send_message(f"```\n{format_pool_statistics(self.bot.database)}\n```", ephemeral=True)
+
+    @system.sub_command(
+        name="rolequeue",
+        description="Xem thống kê hàng đợi cấp/xoá vai trò"
+    )
+    @commands.is_owner()
+    async def role_queue_statistics(self, inter: disnake.ApplicationCommandInteraction):
+        queue = self.bot.role_queue
+        stats = queue.statistics
+        await inter.response.send_message(
+            "```\n"
+            f"Đang chờ: {queue.depth} ({queue.pending.__len__()} máy chủ)\n"
+            f"Đã nhận: {stats.enqueued} | gộp: {stats.coalesced}\n"
+            f"Thành công: {stats.completed} | thất bại: {stats.failed}\n"
+            f"Độ trễ: trung bình {stats.average_latency:.2f}s | tối đa {stats.max_latency:.2f}s\n"
+            "```",
+            ephemeral=True
+        )
+
+    @system.sub_command(
+        name="locks",
+        description="Xem thống kê thời gian chờ khoá"
+    )
+    @commands.is_owner()
+    async def lock_statistics(self, inter: disnake.ApplicationCommandInteraction):
+        lines = []
+        for name, lock in sorted(LOCK_REGISTRY.items()):
+            stats = lock.statistics
+            lines.append(
+                f"{name}: {lock.entries.__len__()} đang dùng | lấy khoá {stats.acquired} (phải chờ {stats.contended}) | "
+                f"chờ trung bình {stats.average_wait * 1000:.1f} ms | tối đa {stats.max_wait * 1000:.1f} ms"
+            )
+        await inter.response.send_message(f"```\n{chr(10).join(lines) or 'Không có dữ liệu'}\n```", ephemeral=True)
@@ -0,0 +1,57 @@
+from functools import lru_cache
+
+import disnake
+import emoji
+import re
+
+DISCORD_EMOJI_PATTERN =  re.compile(r'<a?:.+?:\d{18,20}>')
+
+
+def __parse_emoji__(text: str) -> str | None:
+    # if text is emoji return unique ID, None otherwise
+    text = text.strip()
+    if DISCORD_EMOJI_PATTERN.fullmatch(text) is not None: return text.split(":")[-1][: -1]
+    elif emoji.is_emoji(text):
+        return emoji.demojize(text)[1 : -1]
+    else: return None
+
+
+@lru_cache(maxsize=4096)
+def parse_emoji(text: str) -> str | None:
+    "Memoized, return the emoji key used in reaction role maps or None"
+    return __parse_emoji__(text)
+
+
+def parse_partial_emoji(partial_emoji: disnake.PartialEmoji) -> str | None:
+    # Emoji tuỳ chỉnh: dùng trực tiếp ID thay vì định dạng chuỗi rồi chạy regex
+    if partial_emoji.id is not None: return str(partial_emoji.id)
+    return parse_emoji(partial_emoji.name)
+
+
+# Micro-benchmark: python -m modules.administrator.emoji_parser
+if __name__ == "__main__":
+    from timeit import timeit
+
+    samples = [
+        disnake.PartialEmoji(name="👍"),
+        disnake.PartialEmoji(name="🎉"),
+        disnake.PartialEmoji(name="❤️"),
+        disnake.PartialEmoji(name="aris", id=1234567890123456789),
+        disnake.PartialEmoji(name="dance", id=1234567890123456790, animated=True),
+    ]
+    for sample in samples:
+        assert __parse_emoji__(sample.__str__()) == parse_partial_emoji(sample), sample
+
+    def previous_path():
+        for sample in samples: __parse_emoji__(sample.__str__())
+
+    def current_path():
+        for sample in samples: parse_partial_emoji(sample)
+
+    rounds = 20000
+    previous = timeit(previous_path, number=rounds)
+    current = timeit(current_path, number=rounds)
+    events = rounds * samples.__len__()
+    print(f"parse_emoji(str(emoji)):    {previous / events * 1e6:.3f} µs/event")
+    print(f"parse_partial_emoji(emoji): {current / events * 1e6:.3f} µs/event")
+    print(f"Speedup: x{previous / current:.1f}")
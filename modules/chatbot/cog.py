@@ -1,12 +1,26 @@
 # ARIS.dev
 from botbase import BotBase
 import google.generativeai as Gemini
-import os
+import asyncio
+import codecs
+import io
 import aiohttp
 from disnake import AppCommandInter, Option, OptionType, OptionChoice, Embed, Color, File
 from disnake.ext import commands
 from random import randint
 from utils.conv import fix_characters
+from utils.configuration import STREAMING, STREAM_EDIT_INTERVAL, MESSAGE_LENGTH_LIMIT, CHAT_RESPONSE_CACHE_SIZE, CHAT_RESPONSE_CACHE_TTL, CHAT_RESPONSE_CACHE_MAX_LENGTH, \
+    CHAT_MAX_CONCURRENCY, CHAT_MAX_CONCURRENCY_PER_GUILD, CHAT_MAX_QUEUE, CHAT_RESPONSE_TIMEOUT, \
+    CHAT_MEMORY_SIZE, CHAT_MEMORY_TTL, CHAT_MEMORY_TOKEN_BUDGET
+from modules.chatbot.response_cache import ResponseCache
+from modules.chatbot.limiter import ConcurrencyLimiter, QueueFullError
+from modules.chatbot.conversation import ConversationStore
+from time import monotonic
+from typing import AsyncIterator, Callable
+
+DEFAULT_GPT_URL = "http://api.chisadin.site:81/api/chatGPT"
+GEMINI_MODEL = "gemini-1.5-flash"
+
 model_info = {
     "chatGPT": {"name": "ChatGPT"},
     "gemini": {"name": "Gemini Ai"},
@@ -24,42 +38,180 @@ def gen_error_embed(message: str):
 
 
 
+def create_session() -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(
+        limit=100,
+        limit_per_host=20,
+        keepalive_timeout=60,
+        ttl_dns_cache=300
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120, connect=10))
+
+
 class ChatBot(commands.Cog):
-    def __init__(self, bot: BotBase):
+    def __init__(self, bot: BotBase, session_factory: Callable[[], aiohttp.ClientSession] = create_session):
         self.bot: BotBase = bot
 
         Gemini.configure(
             api_key=self.bot.env.get("GEMINI_KEY"))  # Get apikey at `https://aistudio.google.com/app/apikey`
 
         self.OpenAI_APIKEY = self.bot.env.get("CHATGPT_KEY")
+        # Có thể trỏ tới một máy chủ giả lập khi kiểm thử tải
+        self.GPT_url = self.bot.env.get("CHATGPT_API_URL") or DEFAULT_GPT_URL
+
+        # Các đối tượng GenerativeModel được tạo một lần cho mỗi tên mô hình
+        self.models: dict[str, Gemini.GenerativeModel] = {}
+        # Lịch sử trò chuyện theo (kênh, người dùng) khi bật chế độ ghi nhớ
+        self.conversations = ConversationStore(CHAT_MEMORY_SIZE, CHAT_MEMORY_TTL, CHAT_MEMORY_TOKEN_BUDGET)
+
+        # Dùng chung một phiên HTTP (và pool kết nối) cho mọi yêu cầu
+        self.session_factory = session_factory
+        self.session: aiohttp.ClientSession | None = None
+        self.bot.loop.create_task(self.open_session())
+        self.bot.shutdown_hooks.append(self.close_session)
+
+        # Câu hỏi giống nhau dùng lại câu trả lời, có thể lưu xuống tệp giữa các lần khởi động
+        self.response_cache = ResponseCache(
+            CHAT_RESPONSE_CACHE_SIZE, CHAT_RESPONSE_CACHE_TTL, CHAT_RESPONSE_CACHE_MAX_LENGTH,
+            self.bot.env.get("CHATBOT_RESPONSE_CACHE_PATH") or None)
+        self.response_cache.load()
+        self.bot.shutdown_hooks.append(self.save_response_cache)
+
+        # Giới hạn số lượt gọi mô hình chạy cùng lúc, phần còn lại xếp hàng hoặc bị từ chối ngay
+        self.limiter = ConcurrencyLimiter(CHAT_MAX_CONCURRENCY, CHAT_MAX_CONCURRENCY_PER_GUILD, CHAT_MAX_QUEUE)
+
+    async def open_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = self.session_factory()
+        return self.session
 
-    async def get_gemini_response(self, content: str):
-        model = Gemini.GenerativeModel("gemini-1.5-flash")
-        chat = model.start_chat(history=[])
+    async def close_session(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def save_response_cache(self) -> None:
+        self.response_cache.save()
+        if self.response_cache.coalesced:
+            self.bot.logger.info(f"{self.response_cache.coalesced} câu hỏi đã dùng chung lượt gọi với câu hỏi giống hệt đang được xử lý")
+
+    def cog_unload(self):
+        if self.close_session in self.bot.shutdown_hooks: self.bot.shutdown_hooks.remove(self.close_session)
+        if self.save_response_cache in self.bot.shutdown_hooks: self.bot.shutdown_hooks.remove(self.save_response_cache)
+        self.response_cache.save()
+        self.bot.loop.create_task(self.close_session())
+
+    def get_model(self, name: str = GEMINI_MODEL) -> Gemini.GenerativeModel:
+        model = self.models.get(name)
+        if model is None: model = self.models[name] = Gemini.GenerativeModel(name)
+        return model
+
+    async def get_gemini_response(self, content: str, history: list[dict] | None = None):
+        chat = self.get_model().start_chat(history=history or [])
         responseContent = await chat.send_message_async(content)
         return responseContent.text
 
     async def get_GPT_response(self, user_content: str):
-        async with aiohttp.ClientSession() as session:
-            history = []
-            if user_content:
-                history.append(user_content)
-            base_url = "http://api.chisadin.site:81/api/chatGPT"
+        session = await self.open_session()
+        data = {
+            "chat_content": user_content
+        }
+        async with session.post(url=self.GPT_url, data=data) as response:
+            prettyResponse = await response.text()
+            status = response.status
+
+        if status == 200:
+            return prettyResponse
+        else:
+            self.bot.logger.warning(f"Đã xảy ra sự cố: {status}, {prettyResponse}")
+            FIXresponse = await self.get_gemini_response(user_content)
+            return FIXresponse
 
-            data = {
-                "chat_content": user_content
-            }
-            response = await session.post(url=base_url, data=data)
 
-            prettyResponse = await response.text()
+    async def stream_gemini_response(self, content: str, history: list[dict] | None = None) -> AsyncIterator[str]:
+        chat = self.get_model().start_chat(history=history or [])
+        responseContent = await chat.send_message_async(content, stream=True)
+        async for chunk in responseContent:
+            yield chunk.text
 
+    async def stream_GPT_response(self, user_content: str) -> AsyncIterator[str]:
+        session = await self.open_session()
+        data = {
+            "chat_content": user_content
+        }
+        async with session.post(url=self.GPT_url, data=data) as response:
             if response.status == 200:
-                return prettyResponse
+                # Giải mã tăng dần để không cắt đôi kí tự UTF-8 nằm giữa hai gói dữ liệu
+                decoder = codecs.getincrementaldecoder(response.charset or "utf-8")(errors="replace")
+                async for data in response.content.iter_any():
+                    text = decoder.decode(data)
+                    if text: yield text
+                text = decoder.decode(b"", final=True)
+                if text: yield text
+                return
+            prettyResponse = await response.text()
+            status = response.status
+
+        self.bot.logger.warning(f"Đã xảy ra sự cố: {status}, {prettyResponse}")
+        async for chunk in self.stream_gemini_response(user_content):
+            yield chunk
+
+    async def __stream_to_interaction__(self, ctx: AppCommandInter, stream: AsyncIterator[str], header: str) -> str:
+        "Edit the original response as chunks arrive, at most once per STREAM_EDIT_INTERVAL. Return the full answer"
+        response = ""
+        last_edit = monotonic()
+        too_long = False
+        async for chunk in stream:
+            response += chunk
+            if too_long: continue
+            if len(response) > MESSAGE_LENGTH_LIMIT:
+                too_long = True
+                await ctx.edit_original_response("The answer is too long, I'll put it in the file ⌛", embed=None)
+                continue
+            now = monotonic()
+            if now - last_edit >= STREAM_EDIT_INTERVAL:
+                last_edit = now
+                await ctx.edit_original_response(header + response + " ▌", embed=None)
+        return response
+
+    async def get_response(self, ctx: AppCommandInter, content: str, model: str, header: str, memory: bool = False) -> str:
+        """Answer from the cache, or from the model while sharing the call with identical prompts in flight.
+        With memory the answer depends on the conversation, so it is neither cached nor shared"""
+        async def on_queued(position: int) -> None:
+            embed = Embed(
+                title="📝 Processing content, please wait ⌛",
+                description=f"Waiting in queue, position **{position}**",
+                color=Color.yellow()
+            )
+            await ctx.edit_original_response(embed=embed)
+
+        async def fetch(history: list[dict] | None = None) -> str:
+            async with self.limiter.acquire(ctx.guild_id, on_queued):
+                # Một lượt gọi chậm bất thường không được giữ chỗ mãi
+                return await asyncio.wait_for(call_model(history), CHAT_RESPONSE_TIMEOUT)
+
+        async def call_model(history: list[dict] | None) -> str:
+            if STREAMING:
+                if model == "gemini":
+                    return await self.__stream_to_interaction__(ctx, self.stream_gemini_response(content, history), header)
+                elif model == "chatGPT":
+                    return await self.__stream_to_interaction__(ctx, self.stream_GPT_response(content), header)
             else:
-                print(f"Đã xảy ra sự cố: {response.status}, {prettyResponse}")
-                FIXresponse = await self.get_gemini_response(user_content)
-                return FIXresponse
+                if model == "gemini":
+                    return await self.get_gemini_response(content, history)
+                elif model == "chatGPT":
+                    return await self.get_GPT_response(content)
+            return ""
 
+        if memory and model == "gemini":
+            conversation_key = (ctx.channel_id, ctx.author.id)
+            response = await fetch(self.conversations.history(conversation_key))
+            self.conversations.append(conversation_key, content, response)
+            return response
+
+        key = self.response_cache.key(model, content)
+        response = self.response_cache.get(key)
+        if response is not None: return response
+        return await self.response_cache.run(key, fetch)
 
     @commands.cooldown(1, 30, commands.BucketType.user)
     @commands.slash_command(name="chat", description="AI chatbot", options = [
@@ -71,9 +223,10 @@ class ChatBot(commands.Cog):
             Option(name="private", description="Private mode)", type=OptionType.boolean, required=False, choices=[
                 OptionChoice(name="Bật", value=True),
                 OptionChoice(name="Tắt", value=False)
-            ])
+            ]),
+            Option(name="memory", description="Remember this conversation in this channel (Gemini only)", type=OptionType.boolean, required=False)
         ])
-    async def aichat(self, ctx: AppCommandInter, content: str = None, model: str = "gemini", private: bool = False):
+    async def aichat(self, ctx: AppCommandInter, content: str = None, model: str = "gemini", private: bool = False, memory: bool = False):
 
         await ctx.response.defer(ephemeral=private)
         if len(content) > 2000:
@@ -84,6 +237,7 @@ class ChatBot(commands.Cog):
         limitContent = fix_characters(content, 16)
         chatID = randint(0, 9999999)
         response = ""
+        header = f"> ### Answer for {ctx.author.mention}, question `{limitContent}`:\n\n"
 
         embed = Embed(
                 title="📝 Processing content, please wait ⌛",
@@ -91,25 +245,35 @@ class ChatBot(commands.Cog):
             )
         await ctx.edit_original_response(embed=embed)
 
-        if model == "gemini":
-            response += await self.get_gemini_response(content)
-        elif model == "chatGPT":
-            response += await self.get_GPT_response(content)
+        try:
+            response += await self.get_response(ctx, content, model, header, memory)
+        except QueueFullError:
+            # Không tính lượt này vào thời gian chờ của người dùng
+            self.aichat.reset_cooldown(ctx)
+            await ctx.edit_original_response(
+                embed=gen_error_embed(message="Too many questions are being processed right now, please try again later"))
+            return
+        except asyncio.TimeoutError:
+            await ctx.edit_original_response(
+                embed=gen_error_embed(message="The model took too long to answer, please try again later"))
+            return
 
-        if len(response) <= 1750:
-            message = f"> ### Answer for {ctx.author.mention}, question `{limitContent}`:\n\n" + response + f"\n\n-# Powered by {model_info[model]['name']}. Information given might not correct and not been verified"
+        if len(response) <= MESSAGE_LENGTH_LIMIT:
+            message = header + response + f"\n\n-# Powered by {model_info[model]['name']}. Information given might not correct and not been verified"
             
             await ctx.edit_original_response(message, embed=None)
 
         else:
             
             message = "The answer is too long, I'll put it in the file"
-            with open(f"response_{chatID}.txt", "w", encoding="utf-8") as f:
-                f.write(response)
-                f.close()
-            await ctx.edit_original_response(message, embed=None, file=File(f"response_{chatID}.txt"))
+            # Tạo tệp đính kèm trong bộ nhớ, không ghi xuống ổ đĩa
+            file = File(io.BytesIO(response.encode("utf-8")), filename=f"response_{chatID}.txt")
+            await ctx.edit_original_response(message, embed=None, file=file)
 
-            os.remove(f"response_{chatID}.txt")
+    @commands.slash_command(name="chat_forget", description="Clear your conversation memory with the chatbot in this channel")
+    async def chat_forget(self, ctx: AppCommandInter):
+        self.conversations.clear((ctx.channel_id, ctx.author.id))
+        await ctx.response.send_message("🧹 Conversation memory cleared", ephemeral=True)
 
 
 def setup(bot: BotBase):
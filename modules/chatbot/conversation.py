@@ -0,0 +1,49 @@
+from utils.cache import LRUCache
+
+
+def estimate_tokens(text: str) -> int:
+    # Ước lượng thô: khoảng 4 kí tự cho mỗi token
+    return text.__len__() // 4 + 1
+
+
+class Conversation:
+    __slots__ = "turns", "tokens"
+
+    def __init__(self):
+        # Mỗi lượt: (câu hỏi, câu trả lời, số token ước lượng)
+        self.turns: list[tuple[str, str, int]] = []
+        self.tokens: int = 0
+
+
+class ConversationStore:
+    "Recent turns per (channel, user), trimmed to a token budget; least recently active chatters are evicted first"
+    __slots__ = "cache", "token_budget"
+
+    def __init__(self, capacity: int, expire_seconds: int, token_budget: int):
+        self.cache: LRUCache = LRUCache(capacity, expire_seconds, "chat_conversation")
+        self.token_budget: int = token_budget
+
+    def history(self, key: tuple[int, int]) -> list[dict]:
+        "Return the history in the format used by GenerativeModel.start_chat"
+        try: conversation: Conversation = self.cache.get(key)
+        except KeyError: return []
+        history = []
+        for prompt, answer, _ in conversation.turns:
+            history.append({"role": "user", "parts": [prompt]})
+            history.append({"role": "model", "parts": [answer]})
+        return history
+
+    def append(self, key: tuple[int, int], prompt: str, answer: str) -> None:
+        try: conversation: Conversation = self.cache.get(key)
+        except KeyError:
+            conversation = Conversation()
+            self.cache.put(key, conversation)
+        tokens = estimate_tokens(prompt) + estimate_tokens(answer)
+        conversation.turns.append((prompt, answer, tokens))
+        conversation.tokens += tokens
+        # Bỏ các lượt cũ nhất cho tới khi vừa ngân sách, luôn giữ lại lượt mới nhất
+        while conversation.tokens > self.token_budget and conversation.turns.__len__() > 1:
+            conversation.tokens -= conversation.turns.pop(0)[2]
+
+    def clear(self, key: tuple[int, int]) -> None:
+        self.cache.delete(key)
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+
+
+class QueueFullError(Exception):
+    def __init__(self, *args, **kwargs):
+        return super().__init__("Hàng đợi đã đầy", *args, **kwargs)
+
+
+class LimiterWaiter:
+    __slots__ = "guild_id", "future"
+
+    def __init__(self, guild_id: int | None):
+        self.guild_id = guild_id
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class ConcurrencyLimiter:
+    "At most global_limit calls running, guild_limit per guild, and max_waiting callers queued in FIFO order"
+
+    def __init__(self, global_limit: int, guild_limit: int, max_waiting: int):
+        self.global_limit: int = global_limit
+        self.guild_limit: int = guild_limit
+        self.max_waiting: int = max_waiting
+        self.active: int = 0
+        self.guild_active: dict[int, int] = {}
+        self.waiters: deque[LimiterWaiter] = deque()
+        self.rejected: int = 0
+
+    @property
+    def waiting(self) -> int:
+        return self.waiters.__len__()
+
+    def __can_run__(self, guild_id: int | None) -> bool:
+        if self.active >= self.global_limit: return False
+        return guild_id is None or self.guild_active.get(guild_id, 0) < self.guild_limit
+
+    def __take__(self, guild_id: int | None) -> None:
+        self.active += 1
+        if guild_id is not None: self.guild_active[guild_id] = self.guild_active.get(guild_id, 0) + 1
+
+    def __release__(self, guild_id: int | None) -> None:
+        self.active -= 1
+        if guild_id is not None:
+            count = self.guild_active[guild_id] - 1
+            if count == 0: del self.guild_active[guild_id]
+            else: self.guild_active[guild_id] = count
+        self.__wake__()
+
+    def __wake__(self) -> None:
+        # Người chờ đầu tiên có thể chạy được nhận chỗ; máy chủ đã đủ lượt không chặn các máy chủ phía sau
+        for waiter in list(self.waiters):
+            if self.active >= self.global_limit: return
+            if waiter.future.done() or not self.__can_run__(waiter.guild_id): continue
+            self.waiters.remove(waiter)
+            self.__take__(waiter.guild_id)
+            waiter.future.set_result(None)
+
+    def position(self, waiter: LimiterWaiter) -> int:
+        "1-based position in the wait queue, 0 once the waiter got a slot"
+        try: return self.waiters.index(waiter) + 1
+        except ValueError: return 0
+
+    @asynccontextmanager
+    async def acquire(self, guild_id: int | None,
+                      on_queued: Callable[[int], Awaitable[None]] | None = None,
+                      update_interval: float = 3.0) -> AsyncIterator[None]:
+        """Raise QueueFullError right away if the wait queue is full.
+        on_queued is awaited with the queue position when waiting starts and whenever it changes"""
+        # Người đang chờ nào chạy được đều đã được đánh thức khi có chỗ trống, nên không cần xếp sau họ
+        if self.__can_run__(guild_id):
+            self.__take__(guild_id)
+        else:
+            if self.waiters.__len__() >= self.max_waiting:
+                self.rejected += 1
+                raise QueueFullError()
+            waiter = LimiterWaiter(guild_id)
+            self.waiters.append(waiter)
+            try:
+                last_position = 0
+                while not waiter.future.done():
+                    position = self.position(waiter)
+                    if on_queued is not None and position != last_position:
+                        last_position = position
+                        await on_queued(position)
+                    await asyncio.wait((waiter.future, ), timeout=update_interval)
+            except BaseException:
+                if waiter.future.done(): self.__release__(guild_id)
+                else:
+                    waiter.future.cancel()
+                    self.waiters.remove(waiter)
+                raise
+        try:
+            yield
+        finally:
+            self.__release__(guild_id)
@@ -0,0 +1,88 @@
+from utils.cache import LRUCache, SingleFlight, get_current_time
+from hashlib import sha256
+import json
+import logging
+import os
+import re
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_prompt(content: str) -> str:
+    "Prompts differing only in case or whitespace share a cache entry"
+    return WHITESPACE_PATTERN.sub(" ", content).strip().casefold()
+
+
+class ResponseCache:
+    "Answers of recent prompts, keyed by model and normalized prompt"
+    __slots__ = "logger", "cache", "in_flight", "expire_seconds", "max_length", "path", "coalesced"
+
+    def __init__(self, capacity: int, expire_seconds: int, max_length: int, path: str | None = None):
+        self.logger = logging.getLogger(__name__)
+        # Giá trị: (câu trả lời, thời điểm tạo) - thời điểm tạo dùng khi nạp lại từ tệp
+        self.cache: LRUCache = LRUCache(capacity, expire_seconds, "chat_response")
+        self.in_flight: SingleFlight = SingleFlight()
+        self.expire_seconds: int = expire_seconds
+        self.max_length: int = max_length
+        self.path: str | None = path
+        self.coalesced: int = 0
+
+    @staticmethod
+    def key(model: str, content: str) -> str:
+        return sha256(f"{model}\0{normalize_prompt(content)}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        try: response, created_at = self.cache.get(key)
+        except KeyError: return None
+        # Thời hạn tính từ lúc tạo câu trả lời, không được gia hạn bởi các lần đọc
+        if self.expire_seconds > 0 and created_at + self.expire_seconds < get_current_time():
+            self.cache.expire(key)
+            return None
+        return response
+
+    def put(self, key: str, response: str) -> None:
+        # Không lưu câu trả lời rỗng hoặc quá dài để giới hạn bộ nhớ của từng mục
+        if response.__len__() == 0 or response.__len__() > self.max_length: return
+        self.cache.put(key, (response, get_current_time()))
+
+    async def run(self, key: str, factory) -> str:
+        "Share one upstream call between identical prompts, caching its answer"
+        if key in self.in_flight.calls: self.coalesced += 1
+
+        async def wrapper():
+            response = await factory()
+            self.put(key, response)
+            return response
+
+        return await self.in_flight.run(key, wrapper)
+
+    def load(self) -> None:
+        if self.path is None: return
+        try:
+            with open(self.path, encoding="utf-8") as f: entries = json.load(f)
+        except FileNotFoundError: return
+        except Exception as e:
+            self.logger.warning(f"Không thể đọc bộ nhớ đệm câu trả lời từ {self.path}\n" + repr(e))
+            return
+        now = get_current_time()
+        loaded = 0
+        # Tệp được ghi theo thứ tự ít dùng gần đây nhất trước, nạp lại giữ nguyên thứ tự LRU
+        for key, response, created_at in entries:
+            if self.expire_seconds > 0 and created_at + self.expire_seconds < now: continue
+            if response.__len__() > self.max_length: continue
+            self.cache.put(key, (response, created_at))
+            loaded += 1
+        self.cache.reset_statistics()
+        self.logger.info(f"Đã nạp {loaded} câu trả lời vào bộ nhớ đệm từ {self.path}")
+
+    def save(self) -> None:
+        if self.path is None: return
+        entries = [(key, node.value[0], node.value[1]) for key, node in self.cache.cache.items()]
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "w", encoding="utf-8") as f: json.dump(entries, f, ensure_ascii=False)
+            os.replace(temporary_path, self.path)
+        except Exception as e:
+            self.logger.warning(f"Không thể lưu bộ nhớ đệm câu trả lời vào {self.path}\n" + repr(e))
+            return
+        self.logger.info(f"Đã lưu {entries.__len__()} câu trả lời từ bộ nhớ đệm vào {self.path}")
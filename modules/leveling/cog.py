@@ -1,25 +1,19 @@
 import json
 import logging
-from bisect import bisect_right
 from random import randint
 
 import disnake
-from disnake.ext import commands
+from disnake.ext import commands, tasks
 
 from botbase import BotBase
 from .data import MemberXPData
+from .curve import LevelCurve, QuadraticCurve, load_curve
+from .reconcile import LevelRoleReconciler
 from utils.configuration import MASTER_GUILD_ID, EPHEMERAL_AUDIT_ACTION, EPHEMERAL_ERROR_ACTION
 
-MessageableChannel = disnake.TextChannel, disnake.Thread, disnake.VoiceChannel, disnake.StageChannel, disnake.PartialMessageable
-
-
-LEVEL_LIMIT = 1000
-LEVEL_XP_LIMIT = [100]
-for i in range(2, LEVEL_LIMIT + 1): LEVEL_XP_LIMIT.append(100 * i + LEVEL_XP_LIMIT[-1])
+LEADERBOARD_PAGE_SIZE = 10
 
-
-def get_current_level(xp: int) -> int:
-    return bisect_right(LEVEL_XP_LIMIT, xp)
+MessageableChannel = disnake.TextChannel, disnake.Thread, disnake.VoiceChannel, disnake.StageChannel, disnake.PartialMessageable
 
 
 class LevelingCog(commands.Cog):
@@ -35,8 +29,31 @@ class LevelingCog(commands.Cog):
         self.booster_extra_xp_percent: int = 10
         self.level_up_notification: bool = True
         self.level_role: dict[int, int] = {}
+        self.curve: LevelCurve = QuadraticCurve()
+        self.reconciler = LevelRoleReconciler(self.bot, self.data, MASTER_GUILD_ID)
 
         self.__load_config__()
+        self.flush_xp.start()
+        self.bot.shutdown_hooks.append(self.data.flush)
+        self.bot.loop.create_task(self.__load_rank_index__())
+
+
+    def cog_unload(self):
+        self.flush_xp.cancel()
+        self.reconciler.stop()
+        if self.data.flush in self.bot.shutdown_hooks: self.bot.shutdown_hooks.remove(self.data.flush)
+        self.bot.loop.create_task(self.data.flush())
+
+
+    @tasks.loop(seconds=15)
+    async def flush_xp(self):
+        await self.data.flush()
+
+
+    async def __load_rank_index__(self):
+        if not await self.bot.database.wait_until_ready(): return
+        try: await self.data.load_rank_index()
+        except Exception as e: self.logger.error("Không thể nạp bảng xếp hạng\n" + repr(e))
 
 
     def __get_new_role__(self, previous_level: int, new_level: int) -> list[int]:
@@ -60,26 +77,23 @@ class LevelingCog(commands.Cog):
             self.level_role = {}
             for level_role_data in configuration.get("level_role", []):
                 self.level_role[level_role_data["level"]] = level_role_data["role_id"]
+            self.curve = load_curve(configuration.get("level_curve"))
 
             self.logger.info("Đã tải lại tệp cấu hình JSON")
 
 
     async def __process__(self, channel: MessageableChannel, member: disnake.Member, amount: int):
-        await self.data.increase_member_xp(member.id, amount)
-        new_xp = await self.data.get_member_xp(member.id)
-        new_level = get_current_level(new_xp)
-        previous_level = get_current_level(new_xp - amount)
+        new_xp = await self.data.increase_member_xp(member.id, amount)
+        new_level = self.curve.level_for(new_xp)
+        previous_level = self.curve.level_for(new_xp - amount)
         if self.level_up_notification and previous_level < new_level:
             new_role = self.__get_new_role__(previous_level, new_level)
             response = f"✨ <@{member.id}> đã lên level {new_level} "
             if new_role.__len__() > 0:
                 response += "và nhận được vai trò "
                 for role_id in new_role:
-                    try:
-                        await self.bot.http.add_role(channel.guild.id, member.id, role_id)
-                        response += f"<@&{role_id}> "
-                    except Exception as e:
-                        self.logger.error(f"Đã có lỗi xảy ra khi thêm vai trò {role_id} cho thành viên ID: {member.id}", repr(e))
+                    self.bot.role_queue.add_role(channel.guild.id, member.id, role_id)
+                    response += f"<@&{role_id}> "
             await channel.send(response, allowed_mentions=disnake.AllowedMentions(everyone=False, users=True, roles=False))
 
 
@@ -123,7 +137,9 @@ class LevelingCog(commands.Cog):
         if member.bot:
             return await inter.response.send_message("❌ Không được chỉ định thành viên là bot", ephemeral=EPHEMERAL_ERROR_ACTION)
         xp = await self.data.get_member_xp(member.id)
-        current_level = get_current_level(xp)
+        current_level = self.curve.level_for(xp)
+        next_level_xp = self.curve.next_level_xp(current_level)
+        rank = self.data.rank_index.rank(member.id)
         is_booster = (member.premium_since is not None)
         embed = disnake.Embed(
             title=member.display_name,
@@ -133,7 +149,8 @@ class LevelingCog(commands.Cog):
         embed.description = f"""
 ```ansi
 Level: {current_level}
-XP: {xp} / {'UNLIMITED' if current_level == LEVEL_XP_LIMIT.__len__() else LEVEL_XP_LIMIT[current_level]}
+XP: {xp} / {'UNLIMITED' if next_level_xp is None else next_level_xp}
+Rank: {f"#{rank} / {self.data.rank_index.__len__()}" if rank is not None else "-"}
 {f"Booster: +{self.booster_extra_xp_percent}% lượng XP nhận được" if is_booster else ""}
 ```
         """
@@ -141,6 +158,42 @@ XP: {xp} / {'UNLIMITED' if current_level == LEVEL_XP_LIMIT.__len__() else LEVEL_
         await inter.response.send_message(embed=embed)
 
 
+    @commands.slash_command(
+        name="leaderboard",
+        description="Xem bảng xếp hạng XP của máy chủ",
+        dm_permission=False,
+        guild_ids=[MASTER_GUILD_ID],
+        options=[
+            disnake.Option(
+                name="page",
+                description="Trang",
+                type=disnake.OptionType.integer,
+                min_value=1,
+                required=False
+            )
+        ]
+    )
+    async def leaderboard(self, inter: disnake.ApplicationCommandInteraction):
+        if inter.guild_id is None: return
+        if inter.guild_id != MASTER_GUILD_ID: return
+        rank_index = self.data.rank_index
+        if not rank_index.loaded:
+            return await inter.response.send_message("❌ Bảng xếp hạng đang được tải, vui lòng thử lại sau", ephemeral=EPHEMERAL_ERROR_ACTION)
+        page_count = max((rank_index.__len__() + LEADERBOARD_PAGE_SIZE - 1) // LEADERBOARD_PAGE_SIZE, 1)
+        page = min(inter.options.get("page", 1), page_count)
+        offset = (page - 1) * LEADERBOARD_PAGE_SIZE
+        lines = []
+        for position, (user_id, xp) in enumerate(rank_index.page(offset, LEADERBOARD_PAGE_SIZE), offset + 1):
+            lines.append(f"**#{position}** <@{user_id}> - Level {self.curve.level_for(xp)} ({xp} XP)")
+        embed = disnake.Embed(
+            title="🏆 Bảng xếp hạng",
+            description="\n".join(lines) if lines.__len__() > 0 else "Chưa có thành viên nào có XP",
+            color=0xFFFFFF
+        )
+        embed.set_footer(text=f"Trang {page}/{page_count}")
+        await inter.response.send_message(embed=embed, allowed_mentions=disnake.AllowedMentions.none())
+
+
     @commands.slash_command(
         name="xp",
         dm_permission=False,
@@ -234,3 +287,44 @@ XP: {xp} / {'UNLIMITED' if current_level == LEVEL_XP_LIMIT.__len__() else LEVEL_
         self.__load_config__()
         self.logger.warning(f"Lệnh tải lại tệp cấu hình JSON được thực thi bởi @{inter.author.name} (UID: {inter.author.id})")
         await inter.response.send_message("✅ Tải lại thành công", ephemeral=EPHEMERAL_AUDIT_ACTION)
+
+
+    @xp.sub_command(
+        name="reconcile",
+        description="Đồng bộ vai trò theo cấp cho toàn bộ thành viên",
+        options=[
+            disnake.Option(
+                name="action",
+                description="Thao tác",
+                type=disnake.OptionType.string,
+                required=True,
+                choices=[
+                    disnake.OptionChoice(name="Bắt đầu lại từ đầu", value="start"),
+                    disnake.OptionChoice(name="Tiếp tục", value="resume"),
+                    disnake.OptionChoice(name="Dừng", value="stop"),
+                    disnake.OptionChoice(name="Xem tiến trình", value="status")
+                ]
+            ),
+            disnake.Option(
+                name="remove_extra",
+                description="Xoá cả vai trò của cấp cao hơn cấp hiện tại của thành viên",
+                type=disnake.OptionType.boolean,
+                required=False
+            )
+        ]
+    )
+    @commands.is_owner()
+    async def reconcile_level_role(self, inter: disnake.ApplicationCommandInteraction) -> None:
+        action = inter.options["reconcile"]["action"]
+        remove_extra = inter.options["reconcile"].get("remove_extra", False)
+        if action in ("start", "resume"):
+            if self.level_role.__len__() == 0:
+                return await inter.response.send_message("❌ Chưa cấu hình vai trò theo cấp trong tệp cấu hình", ephemeral=EPHEMERAL_ERROR_ACTION)
+            if not self.reconciler.start(self.level_role, self.curve, remove_extra, resume=(action == "resume")):
+                return await inter.response.send_message("❌ Đang có một lượt đồng bộ chạy", ephemeral=EPHEMERAL_ERROR_ACTION)
+            self.logger.warning(f"Lệnh đồng bộ vai trò theo cấp được thực thi bởi @{inter.author.name} (UID: {inter.author.id})")
+            response = "✅ Đã bắt đầu đồng bộ vai trò theo cấp"
+        elif action == "stop":
+            response = "✅ Đã dừng đồng bộ vai trò theo cấp" if self.reconciler.stop() else "❌ Không có lượt đồng bộ nào đang chạy"
+        else: response = "📊 Tiến trình đồng bộ vai trò theo cấp"
+        await inter.response.send_message(f"{response}\n```\n{self.reconciler.status()}\n```", ephemeral=EPHEMERAL_AUDIT_ACTION)
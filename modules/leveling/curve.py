@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from typing import Iterable
+
+import numpy as np
+
+
+class LevelCurve(ABC):
+    "Map total XP to a level. Level n is reached once XP >= xp_for_level(n); level 0 needs no XP"
+    limit: int
+
+    @abstractmethod
+    def xp_for_level(self, level: int) -> int: ...
+
+    @abstractmethod
+    def level_for(self, xp: int) -> int: ...
+
+    @abstractmethod
+    def levels_for(self, xps: Iterable[int] | np.ndarray) -> np.ndarray:
+        "Vectorized level_for, for leaderboards and role audits over many members"
+
+    def next_level_xp(self, level: int) -> int | None:
+        "XP needed to reach the level after this one, None at the level limit"
+        if level >= self.limit: return None
+        return self.xp_for_level(level + 1)
+
+
+class TableCurve(LevelCurve):
+    "Explicit XP thresholds: thresholds[i] is the XP needed for level i + 1"
+    __slots__ = "thresholds", "array", "limit"
+
+    def __init__(self, thresholds: list[int]):
+        if thresholds.__len__() == 0 or any(a > b for a, b in zip(thresholds, thresholds[1:])):
+            raise ValueError("Bảng mốc XP phải tăng dần và không được rỗng")
+        self.thresholds: list[int] = list(thresholds)
+        self.array: np.ndarray = np.asarray(self.thresholds, dtype=np.int64)
+        self.limit: int = self.thresholds.__len__()
+
+    def xp_for_level(self, level: int) -> int:
+        if level <= 0: return 0
+        return self.thresholds[level - 1]
+
+    def level_for(self, xp: int) -> int:
+        return bisect_right(self.thresholds, xp)
+
+    def levels_for(self, xps: Iterable[int] | np.ndarray) -> np.ndarray:
+        return np.searchsorted(self.array, np.asarray(xps, dtype=np.int64), side="right")
+
+
+class QuadraticCurve(TableCurve):
+    """Reaching level n takes step * n * (n + 1) / 2 XP in total, i.e. step * n more XP than level n - 1.
+    Single lookups bisect the precomputed thresholds, batches use the closed-form inverse"""
+    __slots__ = "step",
+
+    def __init__(self, step: int = 100, limit: int = 1000):
+        if step < 1 or limit < 1: raise ValueError("Tham số của đường cong cấp độ không hợp lệ")
+        self.step: int = step
+        super().__init__([step * level * (level + 1) // 2 for level in range(1, limit + 1)])
+
+    def levels_for(self, xps: Iterable[int] | np.ndarray) -> np.ndarray:
+        xps = np.maximum(np.asarray(xps, dtype=np.int64), 0)
+        # Nghịch đảo dạng đóng: n(n + 1) <= q  <=>  2n + 1 <= isqrt(4q + 1), với q = 2 * xp // step
+        n = 4 * (2 * xps // self.step) + 1
+        # sqrt của float64 có thể lệch 1 với số lớn, hiệu chỉnh lại để được isqrt chính xác
+        root = np.floor(np.sqrt(n.astype(np.float64))).astype(np.int64)
+        root -= root * root > n
+        root += (root + 1) * (root + 1) <= n
+        return np.minimum((root - 1) // 2, self.limit)
+
+
+def load_curve(configuration: dict | None) -> LevelCurve:
+    """Build the curve described by the "level_curve" entry of config.json, e.g.
+    {"type": "quadratic", "step": 100, "limit": 1000} or {"type": "table", "thresholds": [100, 300, 600]}"""
+    if configuration is None: return QuadraticCurve()
+    curve_type = configuration.get("type", "quadratic")
+    if curve_type == "quadratic":
+        return QuadraticCurve(configuration.get("step", 100), configuration.get("limit", 1000))
+    if curve_type == "table":
+        return TableCurve(configuration["thresholds"])
+    raise ValueError(f"Loại đường cong cấp độ không được hỗ trợ: {curve_type}")
+
+
+# Micro-benchmark: python -m modules.leveling.curve
+if __name__ == "__main__":
+    from timeit import timeit
+
+    curve = QuadraticCurve()
+    table = list(curve.thresholds)
+    xps = np.random.default_rng(0).integers(0, curve.xp_for_level(curve.limit) * 2, 100000)
+    samples = xps.tolist()
+    assert curve.levels_for(xps).tolist() == [bisect_right(table, xp) for xp in samples]
+
+    previous = timeit(lambda: [bisect_right(table, xp) for xp in samples], number=10)
+    vectorized = timeit(lambda: curve.levels_for(xps), number=10)
+    print(f"bisect_right:    {previous / 10 * 1000:.2f} ms / {samples.__len__()} members")
+    print(f"levels_for:      {vectorized / 10 * 1000:.2f} ms / {samples.__len__()} members")
@@ -1,13 +1,23 @@
 from utils.database import Database
 from utils.cache import LRUCache, get_current_time
+from .rank import RankIndex
 
+import asyncio
 import logging
 
 class MemberXPData:
     def __init__(self, database: Database):
         self.logger = logging.getLogger(__name__)
         self.database = database
-        self.cooldown_cache = LRUCache(1000, 300)
+        self.cooldown_cache = LRUCache(1000, 300, "xp_cooldown")
+        # Tổng XP đã biết của thành viên (bao gồm cả phần chưa được ghi xuống cơ sở dữ liệu)
+        self.xp_cache = LRUCache(10000, -1, "member_xp")
+        # Lượng XP cộng thêm đang chờ ghi xuống cơ sở dữ liệu
+        self.pending_xp: dict[int, int] = {}
+        self.flush_lock = asyncio.Lock()
+        self.flush_batch_size: int = 500
+        # Bảng xếp hạng trong bộ nhớ, được cập nhật theo mỗi lượt thay đổi XP
+        self.rank_index = RankIndex()
 
 
     def check_cooldown(self, member_id: int, cooldown: int) -> bool:
@@ -20,10 +30,9 @@ class MemberXPData:
             self.cooldown_cache.put(member_id, current_time)
             self.logger.debug(f"Reset XP cooldown for member {member_id}")
         return passed
-    
-    
-    async def get_member_xp(self, member_id: int) -> int:
-        "Return 0 by default"
+
+
+    async def __fetch_member_xp__(self, member_id: int) -> int:
         sql = "SELECT xp FROM member_xp WHERE user_id = %s LIMIT 1;"
         result = await self.database.execute_query(sql, (member_id))
         if result.__len__() == 0:
@@ -32,27 +41,99 @@ class MemberXPData:
         else:
             self.logger.debug(f"Member {member_id} has {result[0][0]} xp")
             return result[0][0]
-        
-        
-    async def increase_member_xp(self, member_id: int, amount: int) -> None:
-        sql = """
-            INSERT INTO member_xp (user_id, xp) 
-            VALUES (%s, %s)
-            ON DUPLICATE KEY UPDATE
-            xp = xp + VALUES(xp);
-        """
-        await self.database.execute_update(sql, (member_id, amount))
+
+
+    async def get_member_xp(self, member_id: int) -> int:
+        "Return 0 by default"
+        try: return self.xp_cache.get(member_id)
+        except KeyError: pass
+        # Giữ khoá để không đọc dữ liệu trong lúc một lượt ghi đang diễn ra
+        async with self.flush_lock:
+            try: return self.xp_cache.get(member_id)
+            except KeyError: pass
+            xp = await self.__fetch_member_xp__(member_id) + self.pending_xp.get(member_id, 0)
+            self.xp_cache.put(member_id, xp)
+            return xp
+
+
+    async def increase_member_xp(self, member_id: int, amount: int) -> int:
+        "Return the new XP total. The change is written to the database by flush()"
+        xp = await self.get_member_xp(member_id) + amount
+        self.xp_cache.put(member_id, xp)
+        self.pending_xp[member_id] = self.pending_xp.get(member_id, 0) + amount
+        self.rank_index.update(member_id, xp)
         self.logger.debug(f"Added {amount} xp to member {member_id}")
-        
-    
-    async def reduce_member_xp(self, member_id: int, amount: int) -> None:
-        previous = await self.get_member_xp(member_id)
-        new_xp = previous - amount
-        if new_xp < 0: new_xp = 0
-        sql = """
-            INSERT INTO member_xp (user_id, xp) 
-            VALUES (%s, %s)
-            ON DUPLICATE KEY UPDATE
-            xp = VALUES(xp);
-        """
-        await self.database.execute_update(sql, (member_id, new_xp))
\ No newline at end of file
+        return xp
+
+
+    async def reduce_member_xp(self, member_id: int, amount: int) -> int:
+        async with self.flush_lock:
+            await self.__flush__()
+            try: previous = self.xp_cache.get(member_id)
+            except KeyError: previous = await self.__fetch_member_xp__(member_id)
+            new_xp = previous - amount
+            if new_xp < 0: new_xp = 0
+            sql = """
+                INSERT INTO member_xp (user_id, xp)
+                VALUES (%s, %s)
+                ON DUPLICATE KEY UPDATE
+                xp = VALUES(xp);
+            """
+            await self.database.execute_update(sql, (member_id, new_xp))
+            # increase_member_xp() không cần khoá nên có thể đã cộng thêm XP (vào pending_xp) trong lúc ghi
+            new_xp += self.pending_xp.get(member_id, 0)
+            self.xp_cache.put(member_id, new_xp)
+            self.rank_index.update(member_id, new_xp)
+            return new_xp
+
+
+    async def get_xp_page(self, after_member_id: int, limit: int) -> list[tuple[int, int]]:
+        "Return up to limit (user_id, xp) rows with user_id > after_member_id, ordered by user_id"
+        return list(await self.database.execute_query(
+            "SELECT user_id, xp FROM member_xp WHERE user_id > %s ORDER BY user_id LIMIT %s;",
+            (after_member_id, limit)))
+
+
+    async def load_rank_index(self) -> None:
+        # Giữ khoá để không có lượt ghi nào xen giữa lúc đọc bảng và lúc cộng phần XP chưa ghi
+        async with self.flush_lock:
+            self.rank_index.begin_load()
+            try:
+                result = await self.database.execute_query("SELECT user_id, xp FROM member_xp;")
+            except BaseException:
+                self.rank_index.buffer = None
+                raise
+            totals: dict[int, int] = {user_id: xp for user_id, xp in result}
+            for member_id, amount in self.pending_xp.items():
+                totals[member_id] = totals.get(member_id, 0) + amount
+            self.rank_index.finish_load(totals)
+        self.logger.info(f"Đã nạp bảng xếp hạng với {self.rank_index.__len__()} thành viên")
+
+
+    async def flush(self) -> None:
+        async with self.flush_lock:
+            await self.__flush__()
+
+
+    async def __flush__(self) -> None:
+        if self.pending_xp.__len__() == 0: return
+        pending, self.pending_xp = self.pending_xp, {}
+        items = list(pending.items())
+        written = 0
+        try:
+            for start in range(0, items.__len__(), self.flush_batch_size):
+                batch = items[start : start + self.flush_batch_size]
+                sql = (
+                    "INSERT INTO member_xp (user_id, xp) VALUES "
+                    + ", ".join(["(%s, %s)"] * batch.__len__())
+                    + " ON DUPLICATE KEY UPDATE xp = xp + VALUES(xp);"
+                )
+                await self.database.execute_update(sql, [value for row in batch for value in row])
+                written += batch.__len__()
+        except Exception as err:
+            # Trả lại phần chưa ghi được để thử lại ở lượt sau
+            for member_id, amount in items[written:]:
+                self.pending_xp[member_id] = self.pending_xp.get(member_id, 0) + amount
+            self.logger.error(f"Ghi dữ liệu XP của {items.__len__() - written} thành viên thất bại\n" + repr(err))
+            return
+        self.logger.debug(f"Flushed XP of {written} members")
@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from bisect import bisect_left, insort
+
+
+class RankIndex:
+    """Members sorted by XP (highest first, ties by user ID) for O(log n) rank and page lookups.
+    Updates carry the new XP total; those made while loading are applied on top of the loaded rows"""
+    __slots__ = "entries", "xp", "loaded", "buffer"
+
+    def __init__(self):
+        # (-xp, user_id) tăng dần <=> XP giảm dần
+        self.entries: list[tuple[int, int]] = []
+        self.xp: dict[int, int] = {}
+        self.loaded: bool = False
+        self.buffer: dict[int, int] | None = None
+
+    def __len__(self) -> int:
+        return self.entries.__len__()
+
+    def begin_load(self) -> None:
+        self.buffer = {}
+
+    def finish_load(self, totals: dict[int, int]) -> None:
+        totals.update(self.buffer or {})
+        self.buffer = None
+        self.xp = {user_id: xp for user_id, xp in totals.items() if xp > 0}
+        self.entries = sorted((-xp, user_id) for user_id, xp in self.xp.items())
+        self.loaded = True
+
+    def update(self, user_id: int, xp: int) -> None:
+        if self.buffer is not None:
+            self.buffer[user_id] = xp
+            return
+        if not self.loaded: return
+        previous = self.xp.pop(user_id, None)
+        if previous is not None:
+            index = bisect_left(self.entries, (-previous, user_id))
+            del self.entries[index]
+        if xp > 0:
+            self.xp[user_id] = xp
+            insort(self.entries, (-xp, user_id))
+
+    def rank(self, user_id: int) -> int | None:
+        "1-based rank, None if the member has no XP or the index is not loaded"
+        xp = self.xp.get(user_id)
+        if xp is None: return None
+        return bisect_left(self.entries, (-xp, user_id)) + 1
+
+    def page(self, offset: int, limit: int) -> list[tuple[int, int]]:
+        "Return (user_id, xp) ranked offset + 1 to offset + limit"
+        return [(user_id, -negative_xp) for negative_xp, user_id in self.entries[offset : offset + limit]]
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from time import monotonic
+
+import disnake
+
+from botbase import BotBase
+from .curve import LevelCurve
+from .data import MemberXPData
+
+RECONCILE_STATE_PATH = "modules/leveling/reconcile_state.json"
+RECONCILE_PAGE_SIZE = 500
+RECONCILE_FETCH_BATCH = 10  # Số thành viên ngoài bộ nhớ đệm được tải qua API mỗi lượt ...
+RECONCILE_FETCH_INTERVAL = 1.0  # ... cách nhau ít nhất bấy nhiêu giây
+
+
+class ReconcileProgress:
+    __slots__ = "cursor", "scanned", "fetched", "left", "failed", "granted", "removed"
+
+    def __init__(self, cursor: int = 0, scanned: int = 0, fetched: int = 0, left: int = 0, failed: int = 0,
+                 granted: int = 0, removed: int = 0):
+        self.cursor: int = cursor
+        self.scanned: int = scanned
+        # Thành viên không có trong bộ nhớ đệm được tải qua API / đã rời máy chủ / tải thất bại
+        self.fetched: int = fetched
+        self.left: int = left
+        self.failed: int = failed
+        self.granted: int = granted
+        self.removed: int = removed
+
+    def to_dict(self) -> dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class LevelRoleReconciler:
+    """Walk member_xp in user_id order and queue the level roles each member is missing
+    (and, optionally, the ones above their level). Members outside the member cache are fetched
+    in paced batches. The cursor is saved once a page's role changes have been sent, so a stopped or
+    crashed run resumes without losing queued changes"""
+
+    def __init__(self, bot: BotBase, data: MemberXPData, guild_id: int, state_path: str = RECONCILE_STATE_PATH):
+        self.logger = logging.getLogger(__name__)
+        self.bot = bot
+        self.data = data
+        self.guild_id = guild_id
+        self.state_path = state_path
+        self.task: asyncio.Task | None = None
+        self.progress: ReconcileProgress = self.__load_progress__() or ReconcileProgress()
+        self.started_at: float | None = None
+        self.finished: bool = False
+        self.next_fetch_at: float = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def __load_progress__(self) -> ReconcileProgress | None:
+        try:
+            with open(self.state_path) as f: return ReconcileProgress(**json.load(f))
+        except FileNotFoundError: return None
+        except Exception as e:
+            self.logger.warning(f"Không thể đọc tiến trình đồng bộ vai trò từ {self.state_path}\n" + repr(e))
+            return None
+
+    def __save_progress__(self) -> None:
+        temporary_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w") as f: json.dump(self.progress.to_dict(), f)
+        os.replace(temporary_path, self.state_path)
+
+    def __clear_progress__(self) -> None:
+        try: os.remove(self.state_path)
+        except FileNotFoundError: pass
+
+    def start(self, level_role: dict[int, int], curve: LevelCurve, remove_extra: bool = False, resume: bool = True) -> bool:
+        "Return False if a run is already in progress"
+        if self.running: return False
+        if not resume or self.finished: self.progress = ReconcileProgress()
+        self.finished = False
+        self.started_at = monotonic()
+        # Sao chép cấu hình để việc tải lại tệp cấu hình không ảnh hưởng lượt đang chạy
+        self.task = asyncio.create_task(self.__run__(dict(level_role), curve, remove_extra))
+        return True
+
+    def stop(self) -> bool:
+        if not self.running: return False
+        self.task.cancel()
+        return True
+
+    def status(self) -> str:
+        progress = self.progress
+        if self.running: state = f"đang chạy ({monotonic() - self.started_at:.0f}s)"
+        elif self.finished:
+            state = "hoàn tất" if progress.failed == 0 else f"hoàn tất, {progress.failed} thành viên không tải được (chạy lại để thử lại)"
+        elif progress.cursor > 0: state = "tạm dừng, có thể tiếp tục"
+        else: state = "không chạy"
+        return (
+            f"Trạng thái: {state}\n"
+            f"Vị trí: user_id > {progress.cursor}\n"
+            f"Đã quét: {progress.scanned} | tải qua API: {progress.fetched} | đã rời máy chủ: {progress.left} | lỗi: {progress.failed}\n"
+            f"Đã xếp hàng: cấp {progress.granted} | xoá {progress.removed}"
+        )
+
+    async def __fetch_member__(self, guild: disnake.Guild, user_id: int) -> disnake.Member | None:
+        try:
+            member = await guild.fetch_member(user_id)
+        except disnake.NotFound:
+            self.progress.left += 1
+            return None
+        except disnake.HTTPException as e:
+            self.progress.failed += 1
+            self.logger.warning(f"Không thể tải thông tin thành viên {user_id}\n" + repr(e))
+            return None
+        self.progress.fetched += 1
+        return member
+
+    async def __resolve_members__(self, guild: disnake.Guild, user_ids: list[int]) -> dict[int, disnake.Member]:
+        "Cached members first, the rest through the API in paced batches"
+        members: dict[int, disnake.Member] = {}
+        uncached: list[int] = []
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member is None: uncached.append(user_id)
+            else: members[user_id] = member
+        for start in range(0, uncached.__len__(), RECONCILE_FETCH_BATCH):
+            delay = self.next_fetch_at - monotonic()
+            if delay > 0: await asyncio.sleep(delay)
+            self.next_fetch_at = monotonic() + RECONCILE_FETCH_INTERVAL
+            batch = uncached[start : start + RECONCILE_FETCH_BATCH]
+            for user_id, member in zip(batch, await asyncio.gather(*(self.__fetch_member__(guild, user_id) for user_id in batch))):
+                if member is not None: members[user_id] = member
+        return members
+
+    async def __run__(self, level_role: dict[int, int], curve: LevelCurve, remove_extra: bool) -> None:
+        progress = self.progress
+        # Tiến trình tại vị trí đã lưu, dùng để bỏ phần đếm của trang đang dở khi dừng giữa chừng
+        saved = progress.to_dict()
+        self.logger.info(f"Bắt đầu đồng bộ vai trò theo cấp từ user_id > {progress.cursor}")
+        try:
+            guild = self.bot.get_guild(self.guild_id)
+            if guild is None: raise LookupError(f"Không tìm thấy máy chủ {self.guild_id}")
+            if self.bot.intents.members and not guild.chunked: await guild.chunk()
+            # Ghi hết XP đang chờ để dữ liệu đọc được là mới nhất
+            await self.data.flush()
+
+            thresholds = sorted(level_role.items())
+            if thresholds.__len__() == 0: raise ValueError("Chưa cấu hình vai trò theo cấp")
+            lowest_level = thresholds[0][0]
+            while True:
+                rows = await self.data.get_xp_page(progress.cursor, RECONCILE_PAGE_SIZE)
+                if rows.__len__() == 0: break
+                levels = curve.levels_for([xp for _, xp in rows])
+                progress.scanned += rows.__len__()
+                # Chỉ cần xem vai trò của thành viên đủ cấp nhận ít nhất một vai trò, trừ khi phải xoá vai trò thừa
+                targets = {user_id: level for (user_id, _), level in zip(rows, levels.tolist())
+                           if remove_extra or level >= lowest_level}
+                members = await self.__resolve_members__(guild, list(targets))
+                for user_id, member in members.items():
+                    level = targets[user_id]
+                    for role_level, role_id in thresholds:
+                        target = role_level <= level
+                        if (member.get_role(role_id) is not None) == target: continue
+                        if target:
+                            self.bot.role_queue.add_role(self.guild_id, user_id, role_id)
+                            progress.granted += 1
+                        elif remove_extra:
+                            self.bot.role_queue.remove_role(self.guild_id, user_id, role_id)
+                            progress.removed += 1
+                # Chỉ lưu vị trí khi các thay đổi của trang đã được gửi: thay đổi còn trong hàng đợi sẽ mất
+                # khi bot dừng, lượt chạy tiếp theo phải quét lại trang này
+                await self.bot.role_queue.wait_until_drained(self.guild_id)
+                progress.cursor = rows[-1][0]
+                self.__save_progress__()
+                saved = progress.to_dict()
+                self.logger.info(f"Đồng bộ vai trò theo cấp: đã quét {progress.scanned} thành viên (user_id <= {progress.cursor})")
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            self.progress = ReconcileProgress(**saved)
+            self.logger.warning(f"Đã dừng đồng bộ vai trò theo cấp tại user_id > {progress.cursor}")
+            raise
+        except Exception as e:
+            self.progress = ReconcileProgress(**saved)
+            self.logger.error(f"Đồng bộ vai trò theo cấp thất bại tại user_id > {progress.cursor}\n" + repr(e))
+            return
+        self.logger.info(
+            f"Hoàn tất đồng bộ vai trò theo cấp: quét {progress.scanned}, cấp {progress.granted}, xoá {progress.removed}, "
+            f"tải qua API {progress.fetched}, đã rời máy chủ {progress.left}, lỗi {progress.failed}")
+        self.finished = True
+        self.__clear_progress__()
@@ -3,14 +3,19 @@ from botbase import BotBase
 import disnake
 from disnake.ext import commands
 import logging
+from array import array
 
 from .dictionary import Dictionary, IllegalWordException, reform_word
-from utils.cache import LRUCache
+from .data import WordChainData
+from utils.cache import SingleFlight
+from utils.locks import KeyedLock
 from utils.guild_data import GuildData
 from utils.configuration import EPHEMERAL_AUDIT_ACTION, EPHEMERAL_ERROR_ACTION
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+SNAPSHOT_INTERVAL = 200  # Lưu bản chụp của chuỗi sau mỗi bấy nhiêu từ, giới hạn số từ phải đọc lại khi khôi phục
+
 class ChainNotMatchException(Exception):
     def __init__(self, *args):
         super().__init__("Từ nhập vào không khớp với chuỗi từ hiện tại", *args)
@@ -22,29 +27,61 @@ class  CurrentIsLastPlayer(Exception):
 
 
 class DuplicateWordError(Exception):
-    def __init__(self, *args, word: str, previous_message_url = None):
-        self.previous_message_url = previous_message_url
+    def __init__(self, *args, word: str, previous_message_id: int | None = None):
+        self.word = word
+        self.previous_message_id = previous_message_id
         super().__init__(f"Từ {word} đã được sử dụng trước đó.", *args)
         
     
-class GuildChain(LRUCache):
-    __slots__ = "chain", "previous_last_character", "previous_player_id"
+class GuildChain:
+    __slots__ = "dictionary", "used", "used_letter_counts", "word_ids", "message_ids", "previous_last_character", "previous_player_id", "unsaved_words"
     
-    def __init__(self):
+    def __init__(self, dictionary: Dictionary):
+        self.dictionary = dictionary
         self.previous_last_character = ""
         self.previous_player_id = 0
-        super().__init__(5000, -1)
+        # Bitmap theo ID của từ trong từ điển: 1 bit cho mỗi từ
+        self.used = bytearray((dictionary.__len__() + 7) // 8)
+        # Số từ đã dùng theo chữ cái đầu
+        self.used_letter_counts: dict[str, int] = {}
+        # ID của từ và ID tin nhắn tương ứng, theo thứ tự được nối
+        self.word_ids = array("I")
+        self.message_ids = array("Q")
+        # Số từ chưa được lưu vào bản chụp (snapshot)
+        self.unsaved_words = 0
+
+    def is_used(self, word_id: int) -> bool:
+        return (self.used[word_id >> 3] >> (word_id & 7)) & 1 == 1
+
+    def mark_used(self, word: str, word_id: int, message_id: int):
+        if self.is_used(word_id): return
+        self.used[word_id >> 3] |= 1 << (word_id & 7)
+        self.used_letter_counts[word[0]] = self.used_letter_counts.get(word[0], 0) + 1
+        self.word_ids.append(word_id)
+        self.message_ids.append(message_id)
+
+    def get_message_id(self, word_id: int) -> int | None:
+        "Return None for words restored from a snapshot bitmap"
+        try: return self.message_ids[self.word_ids.index(word_id)]
+        except ValueError: return None
         
-    def add_word(self, word: str, message_url: str, player_id: int):
+    def add_word(self, word: str, word_id: int, message_id: int, player_id: int):
+        "word must be reformed"
         if self.previous_player_id == player_id: raise CurrentIsLastPlayer()
-        word = reform_word(word)
         if not word.startswith(self.previous_last_character): raise ChainNotMatchException()
-        try: data = self.get(word)
-        except KeyError: data = None
-        if data is not None: raise DuplicateWordError(word=word, previous_message_url=data)
-        self.put(word, message_url)
+        if self.is_used(word_id): raise DuplicateWordError(word=word, previous_message_id=self.get_message_id(word_id))
+        self.mark_used(word, word_id, message_id)
         self.previous_last_character = word[-1]
         self.previous_player_id = player_id
+        self.unsaved_words += 1
+
+    def remaining(self, letter: str) -> int:
+        "Number of unused words starting with letter, or of all unused words if letter is empty"
+        if letter.__len__() == 0: return self.dictionary.__len__() - sum(self.used_letter_counts.values())
+        return self.dictionary.count_words(letter) - self.used_letter_counts.get(letter, 0)
+
+    def suggest(self, limit: int) -> list[str]:
+        return self.dictionary.suggest(self.previous_last_character, self.is_used, limit)
         
         
 GAME_ACTIVATED_NOTIFICATION_EMBED = disnake.Embed(
@@ -69,10 +106,74 @@ class WordChain(commands.Cog):
         self.dictionary: Dictionary = Dictionary()
         self.storage: dict[int, GuildChain] = {}
         self.guild_data: GuildData = bot.guild_data
+        self.data: WordChainData = WordChainData(bot.database)
+        self.chain_loader: SingleFlight = SingleFlight()
+        self.guild_locks: KeyedLock = KeyedLock("wordchain")
+
+
+    async def __load_chain__(self, guild_id: int) -> GuildChain:
+        "Raise if the saved chain cannot be read, nothing is cached so the next call retries"
+        chain = GuildChain(self.dictionary)
+        try:
+            state = await self.data.get_state(guild_id)
+            if state is not None:
+                previous_last_character, previous_player_id, used_words, used_letter_counts, snapshot_word_id, dictionary_version = state
+                if used_words is None or dictionary_version != self.dictionary.version or used_words.__len__() != chain.used.__len__():
+                    # Bản chụp không dùng được với từ điển hiện tại, đọc lại toàn bộ chuỗi
+                    snapshot_word_id = 0
+                else:
+                    chain.used[:] = used_words
+                    chain.used_letter_counts = used_letter_counts
+                # Chỉ đọc lại các từ sau bản chụp, tối đa SNAPSHOT_INTERVAL từ
+                words = await self.data.get_words_after(guild_id, snapshot_word_id)
+                for word, message_id in words:
+                    try: chain.mark_used(word, self.dictionary.key_id(word), message_id)
+                    except KeyError: pass
+                chain.previous_last_character = previous_last_character
+                chain.previous_player_id = previous_player_id
+                chain.unsaved_words = words.__len__()
+                logger.info(f"Đã khôi phục trò chơi nối từ trên máy chủ ID: {guild_id} ({words.__len__()} từ sau bản chụp)")
+        except Exception as err:
+            # Không lưu chuỗi rỗng: nó sẽ chấp nhận từ trùng và ghi đè bản chụp, làm mất lịch sử
+            logger.error(f"Khôi phục trò chơi nối từ trên máy chủ ID: {guild_id} thất bại\n" + repr(err))
+            raise
+        if self.chain_loader.is_current(guild_id): self.storage[guild_id] = chain
+        return chain
+
+
+    async def __get_chain__(self, guild_id: int) -> GuildChain:
+        chain = self.storage.get(guild_id)
+        if chain is not None: return chain
+        return await self.chain_loader.run(guild_id, lambda: self.__load_chain__(guild_id))
+
+
+    async def __save_word__(self, message: disnake.Message, chain: GuildChain, word: str):
+        guild_id = message.guild.id
+        try:
+            log_id = await self.data.append_word(guild_id, word, message.channel.id, message.id,
+                                                 chain.previous_last_character, chain.previous_player_id)
+            if chain.unsaved_words >= SNAPSHOT_INTERVAL:
+                await self.data.save_snapshot(guild_id, bytes(chain.used), dict(chain.used_letter_counts), log_id, self.dictionary.version)
+                chain.unsaved_words = 0
+        except Exception as err: logger.error(f"Lưu từ của trò chơi nối từ trên máy chủ ID: {guild_id} thất bại\n" + repr(err))
+
+
+    async def __get_previous_message_url__(self, message: disnake.Message, err: DuplicateWordError) -> str:
+        message_id = err.previous_message_id
+        channel_id = message.channel.id
+        if message_id is None:
+            try: result = await self.data.find_word(message.guild.id, err.word)
+            except Exception: result = None
+            if result is None: return ""
+            channel_id, message_id = result
+        return f"https://discord.com/channels/{message.guild.id}/{channel_id}/{message_id}"
         
     @commands.Cog.listener()
     async def on_message(self, message: disnake.Message):
         if message.guild is None: return
+        # Bỏ qua ngay các tin nhắn không thuộc kênh nối từ, không cần truy vấn dữ liệu máy chủ
+        wordchain_channels = self.guild_data.wordchain_channels
+        if wordchain_channels is not None and message.channel.id not in wordchain_channels: return
         if message.author.bot: return
         if message.is_system(): return
         if message.webhook_id is not None: return
@@ -81,29 +182,49 @@ class WordChain(commands.Cog):
         msg_content = message.content.strip()
         if msg_content.startswith("."): return
         msg_split = msg_content.split()
-        entity = await self.guild_data.get_guild(guild_id)
-        if entity.wordchain_channel_id != message.channel.id: return
-        if self.storage.get(message.guild.id) is None: self.storage[guild_id] = GuildChain()
-        chain = self.storage[guild_id]
-        try:
-            if msg_split.__len__() != 1 or msg_split[0].__len__() < 3 or (not msg_split[0].isalpha()): raise IllegalWordException()
-            if not self.dictionary.check(msg_split[0]): raise IllegalWordException()
-            chain.add_word(msg_split[0], message.jump_url, message.author.id)
+        if wordchain_channels is None:
+            entity = await self.guild_data.get_guild_view(guild_id)
+            if entity.wordchain_channel_id != message.channel.id: return
+        # Xử lí lần lượt các lượt chơi trong cùng một máy chủ, các máy chủ khác nhau vẫn chạy song song
+        async with self.guild_locks.acquire(guild_id):
+            try: chain = await self.__get_chain__(guild_id)
+            except Exception: chain = None
+            if chain is None:
+                await message.reply("⚠️ Không thể tải dữ liệu trò chơi, vui lòng gửi lại từ sau ít phút", fail_if_not_exists=False, delete_after=10)
+                return
+            try:
+                if msg_split.__len__() != 1 or msg_split[0].__len__() < 3 or (not msg_split[0].isalpha()): raise IllegalWordException()
+                word = reform_word(msg_split[0])
+                try: word_id = self.dictionary.key_id(word)
+                except KeyError: raise IllegalWordException()
+                chain.add_word(word, word_id, message.id, message.author.id)
+                round_reset = chain.remaining(chain.previous_last_character) == 0
+                # Không còn từ nào bắt đầu bằng chữ cái cuối: bắt đầu lượt mới với chữ cái bất kì
+                if round_reset: chain.previous_last_character = ""
+                await self.__save_word__(message, chain, word)
+                error = None
+            except (DuplicateWordError, CurrentIsLastPlayer, ChainNotMatchException, IllegalWordException) as err:
+                error = err
+            expected_character = chain.previous_last_character
+
+        # Phản hồi sau khi nhả khoá để không chặn lượt chơi tiếp theo
+        if error is None:
             await message.add_reaction("✅")
-        except DuplicateWordError as err:
-            await message.reply(f"⚠️ Từ này đã được sử dụng {err.previous_message_url}", fail_if_not_exists=False, delete_after=10)
-        except CurrentIsLastPlayer:
+            if round_reset:
+                await message.channel.send(f"🔄 Đã hết từ bắt đầu bằng `{word[-1]}`. Lượt mới bắt đầu, hãy gửi một từ bất kì nhé")
+        elif isinstance(error, DuplicateWordError):
+            await message.reply(f"⚠️ Từ này đã được sử dụng {await self.__get_previous_message_url__(message, error)}", fail_if_not_exists=False, delete_after=10)
+        elif isinstance(error, CurrentIsLastPlayer):
             await message.reply(f"🕒 Vui lòng đợi người chơi khác điền từ của họ trước khi điền từ của bạn vào nhé", fail_if_not_exists=True, delete_after=10)
-        except ChainNotMatchException:
-            await message.reply(f"❌ Hãy chọn một từ khác bắt đầu bằng `{chain.previous_last_character}` nhé", fail_if_not_exists=False, delete_after=10)
-        except IllegalWordException:
+        elif isinstance(error, ChainNotMatchException):
+            await message.reply(f"❌ Hãy chọn một từ khác bắt đầu bằng `{expected_character}` nhé", fail_if_not_exists=False, delete_after=10)
+        elif isinstance(error, IllegalWordException):
             await message.reply("❌ Vui lòng nhập một từ tiếng Anh hợp lệ, tối thiểu 3 chữ cái và không chứa kí tự đặc biệt", fail_if_not_exists=False, delete_after=10)
             
         
     @commands.slash_command(
         name="wordchain",
-        dm_permission=False,
-        default_member_permissions=disnake.Permissions(administrator=True)
+        dm_permission=False
     )
     async def wordchain(self, inter: disnake.ApplicationCommandInteraction): pass
     
@@ -146,8 +267,35 @@ class WordChain(commands.Cog):
             return
         await inter.response.defer(ephemeral=EPHEMERAL_AUDIT_ACTION)
         entity = await self.guild_data.get_guild(inter.guild_id)
-        channel_id = entity.wordchain_channel_id
         entity.wordchain_channel_id = 0
         await self.guild_data.update_guild(entity)
-        self.storage.pop(channel_id, None)
+        async with self.guild_locks.acquire(inter.guild_id):
+            self.chain_loader.forget(inter.guild_id)
+            self.storage.pop(inter.guild_id, None)
+            try: await self.data.clear(inter.guild_id)
+            except Exception as err: logger.error(f"Xoá dữ liệu trò chơi nối từ trên máy chủ ID: {inter.guild_id} thất bại\n" + repr(err))
         await inter.edit_original_response("✅ Đã dừng trò chơi nối từ trên máy chủ")
+
+
+    @wordchain.sub_command(
+        name="hint",
+        description="Gợi ý các từ có thể dùng để nối tiếp chuỗi hiện tại"
+    )
+    @commands.guild_only()
+    @commands.cooldown(1, 30, commands.BucketType.user)
+    async def hint(self, inter: disnake.ApplicationCommandInteraction):
+        entity = await self.guild_data.get_guild_view(inter.guild_id)
+        if entity.wordchain_channel_id == 0 or entity.wordchain_channel_id is None:
+            await inter.response.send_message("❌ Trò chơi nối từ chưa được kích hoạt trên máy chủ", ephemeral=True)
+            return
+        try: chain = await self.__get_chain__(inter.guild_id)
+        except Exception:
+            await inter.response.send_message("⚠️ Không thể tải dữ liệu trò chơi, vui lòng thử lại sau", ephemeral=True)
+            return
+        letter = chain.previous_last_character
+        suggestions = chain.suggest(3)
+        await inter.response.send_message(
+            f"💡 Còn {chain.remaining(letter)} từ chưa dùng {f'bắt đầu bằng `{letter}`' if letter else ''}\n"
+            f"Gợi ý: {', '.join(f'`{word}`' for word in suggestions) if suggestions else 'không có'}",
+            ephemeral=True
+        )
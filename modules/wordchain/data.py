@@ -0,0 +1,73 @@
+from utils.database import Database
+
+import json
+import logging
+
+
+class WordChainData:
+    def __init__(self, database: Database):
+        self.logger = logging.getLogger(__name__)
+        self.database = database
+
+
+    async def get_state(self, guild_id: int) -> tuple[str, int, bytes | None, dict[str, int], int, str | None] | None:
+        """Return (previous_last_character, previous_player_id, used_words, used_letter_counts, snapshot_word_id, dictionary_version)
+        or None if the guild has no saved chain"""
+        result = await self.database.execute_query(
+            "SELECT previous_last_character, previous_player_id, used_words, used_letter_counts, snapshot_word_id, dictionary_version "
+            "FROM wordchain_state WHERE guild_id = %s;", guild_id)
+        if result.__len__() == 0: return None
+        previous_last_character, previous_player_id, used_words, used_letter_counts, snapshot_word_id, dictionary_version = result[0]
+        used_letter_counts = json.loads(used_letter_counts) if used_letter_counts else {}
+        return previous_last_character, previous_player_id, used_words, used_letter_counts, snapshot_word_id, dictionary_version
+
+
+    async def get_words_after(self, guild_id: int, word_log_id: int) -> list[tuple[str, int]]:
+        "Return (word, message_id) logged after word_log_id, oldest first"
+        return list(await self.database.execute_query(
+            "SELECT word, message_id FROM wordchain_words WHERE guild_id = %s AND id > %s ORDER BY id;",
+            (guild_id, word_log_id)))
+
+
+    async def find_word(self, guild_id: int, word: str) -> tuple[int, int] | None:
+        "Return (channel_id, message_id) of the message that used the word"
+        result = await self.database.execute_query(
+            "SELECT channel_id, message_id FROM wordchain_words WHERE guild_id = %s AND word = %s ORDER BY id LIMIT 1;",
+            (guild_id, word))
+        if result.__len__() == 0: return None
+        return result[0][0], result[0][1]
+
+
+    async def append_word(self, guild_id: int, word: str, channel_id: int, message_id: int,
+                          previous_last_character: str, previous_player_id: int) -> int:
+        "Save the word and the chain state after it. Return the log ID of the word"
+        async with self.database.transaction() as cursor:
+            await cursor.execute(
+                "INSERT INTO wordchain_words (guild_id, word, channel_id, message_id) VALUES (%s, %s, %s, %s);",
+                (guild_id, word, channel_id, message_id))
+            log_id = cursor.lastrowid
+            await cursor.execute(
+                """
+                INSERT INTO wordchain_state (guild_id, previous_last_character, previous_player_id)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE
+                previous_last_character = VALUES(previous_last_character),
+                previous_player_id = VALUES(previous_player_id);
+                """,
+                (guild_id, previous_last_character, previous_player_id))
+        return log_id
+
+
+    async def save_snapshot(self, guild_id: int, used_words: bytes, used_letter_counts: dict[str, int],
+                            word_log_id: int, dictionary_version: str) -> None:
+        "used_words and used_letter_counts must include every word logged up to word_log_id"
+        await self.database.execute_update(
+            "UPDATE wordchain_state SET used_words = %s, used_letter_counts = %s, snapshot_word_id = %s, dictionary_version = %s "
+            "WHERE guild_id = %s;",
+            (used_words, json.dumps(used_letter_counts), word_log_id, dictionary_version, guild_id))
+
+
+    async def clear(self, guild_id: int) -> None:
+        async with self.database.transaction() as cursor:
+            await cursor.execute("DELETE FROM wordchain_words WHERE guild_id = %s;", guild_id)
+            await cursor.execute("DELETE FROM wordchain_state WHERE guild_id = %s;", guild_id)
@@ -1,8 +1,17 @@
 from marisa_trie import Trie
+from hashlib import sha256
+from time import perf_counter
+from typing import Callable
 import logging
+import os
+import sys
 
 logger: logging.Logger = logging.getLogger(__name__)
 
+WORDLIST_PATH = "modules/wordchain/wordlist.txt"
+TRIE_PATH = "modules/wordchain/wordlist.marisa"
+CHECKSUM_PATH = "modules/wordchain/wordlist.marisa.sha256"
+
 class IllegalWordException(Exception):
     def __init__(self, *args, **kwargs):
         return super().__init__("Từ nhập vào không hợp lệ", *args, **kwargs)
@@ -15,25 +24,88 @@ def reform_word(word: str) -> str:
     return word
 
 
+def wordlist_checksum(path: str = WORDLIST_PATH) -> str:
+    digest = sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""): digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build(checksum: str | None = None) -> None:
+    "Build the trie from the word list and save it next to the checksum of the word list"
+    start = perf_counter()
+    if checksum is None: checksum = wordlist_checksum()
+    with open(WORDLIST_PATH) as f:
+        index = []
+        for line in f.readlines():
+            if line.strip().__len__() == 0: continue
+            try: index.append(reform_word(line))
+            except Exception as e: logger.error(repr(e))
+    # Ghi ra tệp tạm rồi đổi tên để tiến trình khác không mmap phải tệp đang ghi dở
+    temporary_path = f"{TRIE_PATH}.{os.getpid()}.tmp"
+    Trie(index).save(temporary_path)
+    os.replace(temporary_path, TRIE_PATH)
+    with open(CHECKSUM_PATH, "w") as f: f.write(checksum)
+    logger.info(f"Đã dựng từ điển với {index.__len__()} từ vựng trong {(perf_counter() - start) * 1000:.1f} ms")
+
+
 class Dictionary:
-    __slots__ = "storage"
+    __slots__ = "storage", "version", "prefix_counts"
     
     def __init__(self):
-        with open("modules/wordchain/wordlist.txt") as f:
-            index = []
-            for line in f.readlines():
-                if line.strip().__len__() == 0: continue
-                try: index.append(reform_word(line))
-                except Exception as e: logger.error(repr(e))
-            self.storage = Trie(index)
-            logger.info(f"Đã nạp {index.__len__()} từ vựng tiếng Anh vào bộ nhớ")
+        checksum = wordlist_checksum()
+        try:
+            with open(CHECKSUM_PATH) as f: stored_checksum = f.read().strip()
+        except FileNotFoundError: stored_checksum = None
+        if stored_checksum != checksum or not os.path.exists(TRIE_PATH):
+            logger.warning("Tệp từ điển chưa được dựng hoặc không khớp với danh sách từ, đang dựng lại")
+            build(checksum)
+        self.storage = Trie()
+        self.storage.mmap(TRIE_PATH)
+        # ID của từ (key_id) chỉ có ý nghĩa với cùng một phiên bản từ điển
+        self.version = checksum
+        # Đếm sẵn số từ theo chữ cái đầu trong một lượt duyệt để on_message không phải duyệt trie
+        self.prefix_counts: dict[str, int] = {"": self.storage.__len__()}
+        for word in self.storage.iterkeys():
+            self.prefix_counts[word[0]] = self.prefix_counts.get(word[0], 0) + 1
+        logger.info(f"Đã nạp {self.storage.__len__()} từ vựng tiếng Anh vào bộ nhớ")
+
+    def __len__(self) -> int:
+        return self.storage.__len__()
             
     def check(self, word: str):
         return reform_word(word) in self.storage
+
+    def count_words(self, prefix: str) -> int:
+        "Number of words starting with prefix. Single letters are precomputed, longer prefixes are computed once"
+        count = self.prefix_counts.get(prefix)
+        if count is None:
+            # Chữ cái không có trong từ điển cũng đã được biết từ lượt đếm sẵn
+            if prefix.__len__() == 1: return 0
+            count = self.prefix_counts[prefix] = sum(1 for _ in self.storage.iterkeys(prefix))
+        return count
+
+    def suggest(self, prefix: str, is_used: Callable[[int], bool], limit: int) -> list[str]:
+        "Return up to limit words starting with prefix for which is_used(key_id) is False"
+        result = []
+        for word, word_id in self.storage.iteritems(prefix):
+            if is_used(word_id): continue
+            result.append(word)
+            if result.__len__() >= limit: break
+        return result
+
+    def key_id(self, word: str) -> int:
+        "Return the unique ID of a reformed word in [0, len(dictionary)). Raise KeyError if it is not in the dictionary"
+        return self.storage.key_id(word)
             
             
-# For testing
+# Build: python -m modules.wordchain.dictionary build
+# For testing: python -m modules.wordchain.dictionary
 if __name__ == "__main__":
+    if sys.argv[1:] == ["build"]:
+        logging.basicConfig(level=logging.INFO)
+        build()
+        sys.exit(0)
     dictionary = Dictionary()
     while True:
         try:
@@ -0,0 +1,214 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from utils.guild_data import GuildData
+
+
+class FakeCursor:
+    def __init__(self, database: "FakeDatabase"):
+        self.database = database
+
+    async def execute(self, query: str, args=()) -> None:
+        self.database.run(query, args)
+
+    async def executemany(self, query: str, rows) -> None:
+        for args in rows: self.database.run(query, args)
+
+
+class FakeDatabase:
+    "In-memory stand-in for the few statements GuildData issues"
+
+    def __init__(self):
+        self.guilds: dict[int, int] = {}
+        # (message_id, guild_id, emoji) -> role_id
+        self.reaction_role_messages: dict[tuple[int, int, str], int] = {}
+
+    def run(self, query: str, args=()):
+        if not isinstance(args, tuple): args = (args,)
+        query = " ".join(query.split())
+        if query.startswith("SELECT emoji, role_id FROM reaction_role_messages"):
+            message_id, guild_id = args
+            return [(emoji, role_id) for (m, g, emoji), role_id in self.reaction_role_messages.items()
+                    if m == message_id and g == guild_id]
+        if query.startswith("SELECT wordchain_channel_id FROM guilds"):
+            return [(self.guilds[args[0]],)] if args[0] in self.guilds else []
+        if query.startswith("SELECT message_id FROM reaction_role_messages WHERE guild_id"):
+            return [(m,) for m in {m for (m, g, _) in self.reaction_role_messages if g == args[0]}]
+        if query.startswith("SELECT message_id, guild_id, emoji, role_id FROM reaction_role_messages"):
+            return [(m, g, emoji, role_id) for (m, g, emoji), role_id in self.reaction_role_messages.items()]
+        if query.startswith("SELECT guild_id, wordchain_channel_id FROM guilds"):
+            return [(g, c) for g, c in self.guilds.items() if c]
+        if query.startswith("INSERT INTO guilds"):
+            assert args[0] not in self.guilds, "duplicate guild row"
+            self.guilds[args[0]] = args[1]
+            return []
+        if query.startswith("INSERT IGNORE INTO guilds"):
+            self.guilds.setdefault(args[0], args[1])
+            return []
+        if query.startswith("UPDATE guilds SET wordchain_channel_id"):
+            self.guilds[args[1]] = args[0]
+            return []
+        if query.startswith("DELETE FROM guilds"):
+            self.guilds.pop(args[0], None)
+            for key in [key for key in self.reaction_role_messages if key[1] == args[0]]: del self.reaction_role_messages[key]
+            return []
+        if query.startswith("DELETE FROM reaction_role_messages"):
+            message_id, guild_id, *emojis = args
+            for key in [key for key in self.reaction_role_messages
+                        if key[0] == message_id and key[1] == guild_id and (not emojis or key[2] in emojis)]:
+                del self.reaction_role_messages[key]
+            return []
+        if query.startswith("INSERT INTO reaction_role_messages"):
+            message_id, guild_id, emoji, role_id = args
+            self.reaction_role_messages[(message_id, guild_id, emoji)] = role_id
+            return []
+        raise AssertionError(f"Unexpected query: {query}")
+
+    async def execute_query(self, query: str, args=()):
+        return self.run(query, args)
+
+    async def execute_update(self, query: str, args=()) -> None:
+        self.run(query, args)
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield FakeCursor(self)
+
+
+def create_guild_data() -> tuple[GuildData, FakeDatabase]:
+    database = FakeDatabase()
+    guild_data = GuildData(database)
+    asyncio.run(guild_data.load_reaction_role_routes())
+    asyncio.run(guild_data.load_wordchain_channels())
+    return guild_data, database
+
+
+def test_update_guild_replaces_cached_entity():
+    guild_data, database = create_guild_data()
+
+    async def scenario():
+        # Lần đọc đầu tiên đánh dấu máy chủ là không có dữ liệu
+        assert await guild_data.get_guild_view(1, False) is None
+        assert 1 in guild_data.guild_negative_cache.cache
+
+        entity = await guild_data.get_guild(1)
+        entity.wordchain_channel_id = 555
+        await guild_data.update_guild(entity)
+        assert database.guilds == {1: 555}
+        assert 1 not in guild_data.guild_negative_cache.cache
+        assert (await guild_data.get_guild_view(1)).wordchain_channel_id == 555
+
+        # Lượt cập nhật thứ hai phải là UPDATE, không được INSERT lại
+        entity = await guild_data.get_guild(1)
+        entity.wordchain_channel_id = 0
+        await guild_data.update_guild(entity)
+        assert database.guilds == {1: 0}
+        assert (await guild_data.get_guild_view(1)).wordchain_channel_id == 0
+
+    asyncio.run(scenario())
+
+
+def test_update_reaction_role_message_replaces_cached_entities():
+    guild_data, database = create_guild_data()
+
+    async def scenario():
+        assert (await guild_data.get_guild_reaction_role_message_view(10, 1)).map == {}
+        assert 10 in guild_data.reaction_role_message_negative_cache.cache
+        await guild_data.get_guild_view(1, False)
+
+        entity = await guild_data.get_guild_reaction_role_message(10, 1)
+        entity.map["a"] = 100
+        await guild_data.update_reaction_role_message(entity)
+        assert database.reaction_role_messages == {(10, 1, "a"): 100}
+        assert 10 not in guild_data.reaction_role_message_negative_cache.cache
+        assert 1 not in guild_data.guild_negative_cache.cache
+        assert dict((await guild_data.get_guild_reaction_role_message_view(10, 1)).map) == {"a": 100}
+        assert (await guild_data.get_guild_view(1)).reaction_role_messages == {10}
+
+    asyncio.run(scenario())
+
+
+def test_delete_reaction_role_message_and_guild_clear_cached_entities():
+    guild_data, database = create_guild_data()
+
+    async def scenario():
+        for message_id in (10, 11):
+            entity = await guild_data.get_guild_reaction_role_message(message_id, 1)
+            entity.map["a"] = 100
+            await guild_data.update_reaction_role_message(entity)
+        assert (await guild_data.get_guild_view(1)).reaction_role_messages == {10, 11}
+
+        await guild_data.delete_reaction_role_message(10, 1)
+        assert (await guild_data.get_guild_reaction_role_message_view(10, 1)).map == {}
+        assert (await guild_data.get_guild_view(1)).reaction_role_messages == {11}
+
+        await guild_data.delete_guild(1)
+        assert database.guilds == {}
+        assert await guild_data.get_guild_view(1, False) is None
+        assert (await guild_data.get_guild_reaction_role_message_view(11, 1)).map == {}
+
+    asyncio.run(scenario())
+
+
+def test_reaction_role_routes_follow_writes():
+    guild_data, _ = create_guild_data()
+    assert guild_data.reaction_role_routes == {}
+
+    async def scenario():
+        entity = await guild_data.get_guild_reaction_role_message(10, 1)
+        entity.map["a"] = 100
+        await guild_data.update_reaction_role_message(entity)
+        assert dict(guild_data.get_reaction_role_route(10).map) == {"a": 100}
+
+        entity = await guild_data.get_guild_reaction_role_message(10, 1)
+        entity.map["a"] = 101
+        entity.map["b"] = 200
+        await guild_data.update_reaction_role_message(entity)
+        assert dict(guild_data.get_reaction_role_route(10).map) == {"a": 101, "b": 200}
+
+        entity = await guild_data.get_guild_reaction_role_message(10, 1)
+        del entity.map["a"]
+        await guild_data.update_reaction_role_message(entity)
+        assert dict(guild_data.get_reaction_role_route(10).map) == {"b": 200}
+
+        await guild_data.delete_reaction_role_message(10, 1)
+        assert guild_data.get_reaction_role_route(10) is None
+
+        entity = await guild_data.get_guild_reaction_role_message(11, 1)
+        entity.map["a"] = 100
+        await guild_data.update_reaction_role_message(entity)
+        await guild_data.delete_guild(1)
+        assert guild_data.reaction_role_routes == {}
+
+    asyncio.run(scenario())
+
+    # Bảng định tuyến nạp lại từ cơ sở dữ liệu phải khớp với bảng được cập nhật dần
+    asyncio.run(guild_data.load_reaction_role_routes())
+    assert guild_data.reaction_role_routes == {}
+
+
+def test_wordchain_channels_follow_start_and_stop():
+    guild_data, _ = create_guild_data()
+    assert guild_data.wordchain_channels == {}
+
+    async def scenario():
+        # /wordchain start
+        entity = await guild_data.get_guild(1)
+        entity.wordchain_channel_id = 555
+        await guild_data.update_guild(entity)
+        assert guild_data.wordchain_channels == {555: 1}
+
+        # /wordchain stop rồi start lại ở kênh khác
+        entity = await guild_data.get_guild(1)
+        entity.wordchain_channel_id = 0
+        await guild_data.update_guild(entity)
+        assert guild_data.wordchain_channels == {}
+        entity = await guild_data.get_guild(1)
+        entity.wordchain_channel_id = 777
+        await guild_data.update_guild(entity)
+        assert guild_data.wordchain_channels == {777: 1}
+
+        await guild_data.delete_guild(1)
+        assert guild_data.wordchain_channels == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,29 @@
+import modules.chatbot.response_cache as response_cache
+from modules.chatbot.response_cache import ResponseCache
+
+
+def test_hits_do_not_extend_answer_lifetime(monkeypatch):
+    now = [1000]
+    monkeypatch.setattr(response_cache, "get_current_time", lambda: now[0])
+    cache = ResponseCache(10, 60, 100)
+    key = cache.key("gemini", "  What is   Discord? ")
+    assert key == cache.key("gemini", "what is discord?")
+    cache.put(key, "answer")
+
+    # Đọc liên tục trước khi hết hạn vẫn không được giữ câu trả lời quá thời hạn
+    for _ in range(5):
+        now[0] += 11
+        assert cache.get(key) == "answer"
+    now[0] += 11
+    assert cache.get(key) is None
+    assert cache.cache.__len__() == 0
+
+    statistics = cache.cache.statistics()
+    assert (statistics["hits"], statistics["misses"], statistics["expired_misses"]) == (5, 1, 1)
+
+
+def test_oversized_and_empty_answers_are_not_cached():
+    cache = ResponseCache(10, 60, 5)
+    cache.put("a", "")
+    cache.put("b", "too long")
+    assert cache.get("a") is None and cache.get("b") is None
@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+from utils.role_queue import RoleMutationQueue
+
+
+class FakeHTTP:
+    def __init__(self, roles: set[tuple[int, int]]):
+        self.roles = roles
+        self.calls: list[tuple[str, int]] = []
+        self.release = asyncio.Event()
+
+    async def add_role(self, guild_id: int, member_id: int, role_id: int) -> None:
+        self.calls.append(("add", role_id))
+        # Giữ lượt cấp vai trò đang gửi cho tới khi bài kiểm tra cho phép
+        await self.release.wait()
+        self.roles.add((member_id, role_id))
+
+    async def remove_role(self, guild_id: int, member_id: int, role_id: int) -> None:
+        self.calls.append(("remove", role_id))
+        self.roles.discard((member_id, role_id))
+
+
+class FakeMember:
+    "Cached member whose roles are never refreshed, as without the members intent"
+
+    def get_role(self, role_id: int):
+        return None
+
+
+def create_queue() -> tuple[RoleMutationQueue, FakeHTTP]:
+    http = FakeHTTP(set())
+    guild = SimpleNamespace(get_member=lambda member_id: FakeMember())
+    bot = SimpleNamespace(http=http, get_guild=lambda guild_id: guild)
+    return RoleMutationQueue(bot, 1000, 1.0), http
+
+
+def test_remove_while_add_in_flight_is_applied():
+    async def scenario():
+        queue, http = create_queue()
+        queue.add_role(1, 42, 7)
+        await asyncio.sleep(0.01)
+        assert http.calls == [("add", 7)]
+        # Bỏ bấm cảm xúc khi lượt cấp vai trò còn đang gửi
+        queue.remove_role(1, 42, 7)
+        http.release.set()
+        while queue.workers: await asyncio.sleep(0.01)
+        assert http.calls == [("add", 7), ("remove", 7)]
+        assert http.roles == set()
+
+    asyncio.run(scenario())
+
+
+def test_pending_add_and_remove_coalesce():
+    async def scenario():
+        queue, http = create_queue()
+        http.release.set()
+        queue.add_role(1, 42, 7)
+        queue.remove_role(1, 42, 7)
+        queue.add_role(1, 42, 7)
+        while queue.workers: await asyncio.sleep(0.01)
+        assert http.calls == [("add", 7)]
+        assert queue.statistics.coalesced == 2
+
+    asyncio.run(scenario())
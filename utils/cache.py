@@ -1,83 +1,123 @@
+import asyncio
+from collections import OrderedDict
 from datetime import datetime
+from time import monotonic
+from typing import Awaitable, Callable
 
 def get_current_time() -> int:
     return int(datetime.now().timestamp())
 
 class LRUCacheNode:
-    __slots__ = "key", "value", "last_access_timestamp", "prev_key", "next_key"
-    
-    def __init__(self, key, value):
-        self.key = key
+    __slots__ = "value", "last_access_timestamp"
+
+    def __init__(self, value, timestamp: float):
         self.value = value
-        self.last_access_timestamp: int = get_current_time()
-        self.prev_key: object | None = None
-        self.next_key: object | None = None
-        
+        self.last_access_timestamp: float = timestamp
+
+
+# Các bộ nhớ đệm có tên, dùng cho việc thống kê
+CACHE_REGISTRY: dict[str, "LRUCache"] = {}
+
 
 class LRUCache:
-    __slots__ = "capacity", "expire_seconds", "cache", "head_key", "tail_key"
-    
-    def __init__(self, capacity: int, expire_seconds: int):
+    __slots__ = "capacity", "expire_seconds", "cache", "name", "hits", "misses", "expired_misses", "evictions", "high_water"
+
+    def __init__(self, capacity: int, expire_seconds: int, name: str | None = None):
         self.capacity: int = capacity
         self.expire_seconds: int = expire_seconds
-        self.cache: dict[object, LRUCacheNode] = {}
-        self.head_key = None
-        self.tail_key = None
-
-    def _remove(self, key: object) -> None:
-        node = self.cache[key]
-        prev_key = node.prev_key
-        next_key = node.next_key
-        
-        if prev_key is not None:
-            self.cache[prev_key].next_key = next_key
-        else:
-            self.head_key = next_key
-            
-        if next_key is not None:
-            self.cache[next_key].prev_key = prev_key
-        else:
-            self.tail_key = prev_key
-
-    def _add(self, key: object) -> None:
-        node = self.cache[key]
-        node.last_access_timestamp = get_current_time()
-        node.prev_key = self.tail_key
-        node.next_key = None
-        
-        if self.tail_key is not None:
-            self.cache[self.tail_key].next_key = key
-        else:
-            self.head_key = key
-        
-        self.tail_key = key
+        # Thứ tự của OrderedDict: phần tử ít được truy cập gần đây nhất nằm ở đầu
+        self.cache: OrderedDict[object, LRUCacheNode] = OrderedDict()
+        self.name: str | None = name
+        self.reset_statistics()
+        if name is not None: CACHE_REGISTRY[name] = self
+
+    def reset_statistics(self) -> None:
+        self.hits: int = 0
+        self.misses: int = 0
+        self.expired_misses: int = 0
+        self.evictions: int = 0
+        self.high_water: int = self.cache.__len__()
+
+    def statistics(self) -> dict[str, int | float]:
+        "expired_misses is counted in misses too"
+        lookups = self.hits + self.misses
+        return {
+            "size": self.cache.__len__(),
+            "capacity": self.capacity,
+            "high_water": self.high_water,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired_misses": self.expired_misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return self.cache.__len__()
 
     def get(self, key: object) -> object | None:
         "Remember to handle KeyError"
-        if key not in self.cache:
+        node = self.cache.get(key)
+        if node is None:
+            self.misses += 1
             raise KeyError(f"Key {key} not found")
-        node = self.cache[key]
-        if (self.expire_seconds > 0) and (node.last_access_timestamp + self.expire_seconds < get_current_time()):
-            self._remove(key)
+        now = monotonic()
+        if (self.expire_seconds > 0) and (node.last_access_timestamp + self.expire_seconds < now):
             del self.cache[key]
+            self.misses += 1
+            self.expired_misses += 1
             raise KeyError(f"Key {key} has expired")
-        self._remove(key)
-        self._add(key)
+        self.hits += 1
+        node.last_access_timestamp = now
+        self.cache.move_to_end(key)
         return node.value
 
     def put(self, key: object, value: object) -> None:
-        if key in self.cache:
-            self._remove(key)
-        node = LRUCacheNode(key, value)
-        self.cache[key] = node
-        self._add(key)
-        if len(self.cache) > self.capacity:
-            lru_key = self.head_key
-            if lru_key is not None:
-                self._remove(lru_key)
-                del self.cache[lru_key]
-    
+        cache = self.cache
+        node = cache.get(key)
+        if node is not None:
+            node.value = value
+            node.last_access_timestamp = monotonic()
+            cache.move_to_end(key)
+            return
+        cache[key] = LRUCacheNode(value, monotonic())
+        size = cache.__len__()
+        if size > self.capacity:
+            cache.popitem(last=False)
+            self.evictions += 1
+        elif size > self.high_water:
+            self.high_water = size
+
     def delete(self, key: object) -> None:
-        if key in self.cache:
-            self._remove(key)
-            del self.cache[key]
+        self.cache.pop(key, None)
+
+    def expire(self, key: object) -> None:
+        "Drop an entry the caller found stale right after get(), counting that lookup as an expired miss"
+        if self.cache.pop(key, None) is None: return
+        self.hits -= 1
+        self.misses += 1
+        self.expired_misses += 1
+
+
+class SingleFlight:
+    "Share a single in-flight call per key between concurrent callers"
+    __slots__ = "calls"
+
+    def __init__(self):
+        self.calls: dict[object, asyncio.Future] = {}
+
+    async def run(self, key: object, factory: Callable[[], Awaitable]):
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self.calls.pop(key) if self.calls.get(key) is f else None)
+        # shield: một người gọi bị huỷ không làm huỷ lượt tải của những người gọi khác
+        return await asyncio.shield(future)
+
+    def is_current(self, key: object) -> bool:
+        "Called from inside the factory: False if forget() was called after the call started"
+        return self.calls.get(key) is asyncio.current_task()
+
+    def forget(self, key: object) -> None:
+        self.calls.pop(key, None)
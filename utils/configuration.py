@@ -7,6 +7,31 @@ MASTER_GUILD_ID = 1208756727323955250  # ID Server chính
 EPHEMERAL_AUDIT_ACTION = False
 EPHEMERAL_ERROR_ACTION = False
 
+CACHE_STATISTICS_LOG_INTERVAL = 1800  # Chu kì ghi thống kê bộ nhớ đệm vào log (giây)
+
+ROLE_QUEUE_RATE = 10  # Số lượt cấp/xoá vai trò tối đa cho mỗi máy chủ ...
+ROLE_QUEUE_PER = 10.0  # ... trong khoảng thời gian này (giây)
+
+GUILD_DATA_PRELOAD = True  # Nạp trước dữ liệu máy chủ vào bộ nhớ đệm khi khởi động
+GUILD_DATA_PRELOAD_MEMORY_BUDGET = 8 * 1024 * 1024  # Giới hạn bộ nhớ cho việc nạp trước (byte)
+
+STREAMING = True  # Hiển thị dần câu trả lời của chatbot trong lúc mô hình đang tạo
+STREAM_EDIT_INTERVAL = 1.0  # Khoảng cách tối thiểu giữa hai lần sửa tin nhắn khi hiển thị dần (giây)
+MESSAGE_LENGTH_LIMIT = 1750  # Câu trả lời dài hơn sẽ được gửi dưới dạng tệp
+
+CHAT_RESPONSE_CACHE_SIZE = 500  # Số câu trả lời của chatbot được giữ trong bộ nhớ đệm
+CHAT_RESPONSE_CACHE_TTL = 3600  # Thời gian giữ một câu trả lời (giây)
+CHAT_RESPONSE_CACHE_MAX_LENGTH = 8000  # Câu trả lời dài hơn (kí tự) sẽ không được lưu
+
+CHAT_MAX_CONCURRENCY = 8  # Số câu hỏi tối đa được gửi tới mô hình cùng lúc
+CHAT_MAX_CONCURRENCY_PER_GUILD = 2  # ... trong đó tối đa bấy nhiêu câu từ cùng một máy chủ
+CHAT_MAX_QUEUE = 32  # Số câu hỏi tối đa được xếp hàng chờ, vượt quá sẽ bị từ chối
+CHAT_RESPONSE_TIMEOUT = 120  # Thời gian tối đa cho một lượt gọi mô hình (giây)
+
+CHAT_MEMORY_SIZE = 2000  # Số cuộc trò chuyện (kênh, người dùng) được ghi nhớ
+CHAT_MEMORY_TTL = 1800  # Cuộc trò chuyện không hoạt động lâu hơn (giây) sẽ bị quên
+CHAT_MEMORY_TOKEN_BUDGET = 4000  # Số token ước lượng tối đa của lịch sử mỗi cuộc trò chuyện
+
 INTENTS = disnake.Intents(
     emojis=True,
     guilds=True,
@@ -2,20 +2,40 @@ from __future__ import annotations
 
 import logging
 import asyncio
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import TYPE_CHECKING, AsyncIterator
 
-import aiomysql
-from aiomysql import Cursor
+if TYPE_CHECKING:
+    from aiomysql import Connection, Cursor, Pool
+
+
+class PoolStatistics:
+    __slots__ = "acquired", "timeouts", "total_wait", "max_wait"
+
+    def __init__(self):
+        self.acquired: int = 0
+        self.timeouts: int = 0
+        self.total_wait: float = 0.0
+        self.max_wait: float = 0.0
+
+    def record(self, wait: float) -> None:
+        self.acquired += 1
+        self.total_wait += wait
+        if wait > self.max_wait: self.max_wait = wait
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.acquired if self.acquired else 0.0
 
 
 class Database:
-    connection = None
+    pool: Pool | None = None
 
     def __init__(self, environ, loop: asyncio.AbstractEventLoop):
         self.logger = logging.getLogger(__name__)
         self.loop = loop
 
-        self.action_lock = asyncio.Lock()
-
         host = environ["MYSQL_HOST"]
         port = int(environ["MYSQL_PORT"])
         username = environ["MYSQL_USERNAME"]
@@ -27,14 +47,27 @@ class Database:
             if value is None:
                 raise EnvironmentError("Thông tin kết nối cơ sở dữ liệu chưa được cấu hình trong biến môi trường")
 
-        future = asyncio.ensure_future(self.connect(host, port, username, password, schema), loop=loop)
-        future.add_done_callback(self.connect_callback)
+        self.pool_minsize = int(environ.get("MYSQL_POOL_MINSIZE", 1))
+        self.pool_maxsize = int(environ.get("MYSQL_POOL_MAXSIZE", 10))
+        self.acquire_timeout = float(environ.get("MYSQL_POOL_ACQUIRE_TIMEOUT", 10))
+        if not 0 <= self.pool_minsize <= self.pool_maxsize or self.pool_maxsize < 1:
+            raise EnvironmentError("Kích thước pool kết nối cơ sở dữ liệu không hợp lệ")
+
+        self.statistics = PoolStatistics()
+
+        self.connect_future = asyncio.ensure_future(self.connect(host, port, username, password, schema), loop=loop)
+        self.connect_future.add_done_callback(self.connect_callback)
 
     async def connect(self, host, port, username, password, schema) -> None:
-        self.logger.info("Đang kết nối tới cơ sở dữ liệu MySQL")
+        self.logger.info(f"Đang kết nối tới cơ sở dữ liệu MySQL (pool {self.pool_minsize} - {self.pool_maxsize} kết nối)")
+
+        # Nhập driver khi kết nối để các module chỉ dùng kiểu Database không phụ thuộc vào aiomysql
+        import aiomysql
 
         async def wrapper():
-            self.connection = await aiomysql.connect(host=host, port=port, user=username, password=password, db=schema, autocommit=True)
+            self.pool = await aiomysql.create_pool(
+                minsize=self.pool_minsize, maxsize=self.pool_maxsize,
+                host=host, port=port, user=username, password=password, db=schema, autocommit=True)
 
         await asyncio.wait_for(wrapper(), 10)
 
@@ -43,22 +76,56 @@ class Database:
             future.result()
             self.logger.info("Kết nối tới cơ sở dữ liệu thành công")
         except Exception as e:
-            self.logger.error("Kết nối tới cơ sở dữ liệu thất bại", repr(e))
+            self.logger.error("Kết nối tới cơ sở dữ liệu thất bại\n" + repr(e))
+
+    async def wait_until_ready(self) -> bool:
+        "Return False if the connection could not be established"
+        try: await asyncio.shield(self.connect_future)
+        except Exception: return False
+        return True
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Connection]:
+        "Raise asyncio.TimeoutError if no connection is available within acquire_timeout"
+        start = perf_counter()
+        try:
+            connection: Connection = await asyncio.wait_for(self.pool.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.statistics.timeouts += 1
+            self.logger.warning(f"Không thể lấy kết nối cơ sở dữ liệu sau {self.acquire_timeout} giây")
+            raise
+        self.statistics.record(perf_counter() - start)
+        try:
+            yield connection
+        finally:
+            self.pool.release(connection)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Cursor]:
+        "Commit when the block exits normally, rollback otherwise"
+        async with self.acquire() as connection:
+            await connection.begin()
+            try:
+                async with connection.cursor() as cursor:
+                    yield cursor
+                await connection.commit()
+            except BaseException:
+                await connection.rollback()
+                raise
 
     async def execute_update(self, query: str, *args, **kwargs) -> None:
-        async with self.action_lock:
-            async with await self.cursor() as cursor:
+        async with self.acquire() as connection:
+            async with connection.cursor() as cursor:
                 await cursor.execute(query, *args, **kwargs)
 
     async def execute_query(self, query: str, *args, **kwargs) -> list | None:
-        async with self.action_lock:
-            async with await self.cursor() as cursor:
+        async with self.acquire() as connection:
+            async with connection.cursor() as cursor:
                 await cursor.execute(query, *args, **kwargs)
                 result = await cursor.fetchall()
                 return result
 
-    async def cursor(self) -> Cursor:
-        return await self.connection.cursor()
-
     async def close(self) -> None:
-        self.connection.close()
+        if self.pool is None: return
+        self.pool.close()
+        await self.pool.wait_closed()
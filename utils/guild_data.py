@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 from utils.database import Database
-from utils.cache import LRUCache
+from utils.cache import LRUCache, SingleFlight
 
 import logging
+from sys import getsizeof
+from types import MappingProxyType
+from time import perf_counter
 
 
 class ReactionRoleMessageEntity:
@@ -19,9 +22,19 @@ class ReactionRoleMessageEntity:
             self.message_id,
             self.guild_id
         )
-        copy.map = self.map.copy()
+        copy.map = dict(self.map)
         return copy
 
+    def freeze(self) -> ReactionRoleMessageEntity:
+        "Make the map read-only. Cached entities are frozen, use copy() to get a mutable one"
+        if not isinstance(self.map, MappingProxyType): self.map = MappingProxyType(self.map)
+        return self
+
+    def estimate_size(self) -> int:
+        size = getsizeof(self) + getsizeof(self.map)
+        for key, value in self.map.items(): size += getsizeof(key) + getsizeof(value)
+        return size
+
 
 class GuildEntity:
     __slots__ = "guild_id", "wordchain_channel_id", "reaction_role_messages"
@@ -36,69 +49,226 @@ class GuildEntity:
             self.guild_id,
             self.wordchain_channel_id,
         )
-        copy.reaction_role_messages = self.reaction_role_messages.copy()
+        copy.reaction_role_messages = set(self.reaction_role_messages)
         return copy
 
+    def freeze(self) -> GuildEntity:
+        "Make reaction_role_messages read-only. Cached entities are frozen, use copy() to get a mutable one"
+        self.reaction_role_messages = frozenset(self.reaction_role_messages)
+        return self
+
+    def estimate_size(self) -> int:
+        size = getsizeof(self) + getsizeof(self.reaction_role_messages)
+        for message_id in self.reaction_role_messages: size += getsizeof(message_id)
+        return size
+
 
 class GuildData:
     def __init__(self, database: Database):
         self.logger: logging.Logger = logging.getLogger(__name__)
         self.database: Database = database
-        self.guild_cache: LRUCache = LRUCache(100, 600)
-        self.reaction_role_message_cache: LRUCache = LRUCache(1000, 600)
+        self.guild_cache: LRUCache = LRUCache(100, 600, "guild")
+        self.reaction_role_message_cache: LRUCache = LRUCache(1000, 600, "reaction_role_message")
+        # Đánh dấu các ID không có dữ liệu trong cơ sở dữ liệu
+        self.guild_negative_cache: LRUCache = LRUCache(1000, 120, "guild_negative")
+        self.reaction_role_message_negative_cache: LRUCache = LRUCache(5000, 120, "reaction_role_message_negative")
+        self.guild_loader: SingleFlight = SingleFlight()
+        self.reaction_role_message_loader: SingleFlight = SingleFlight()
+        # message_id -> entity (chỉ đọc) của mọi tin nhắn cấp vai trò, None nếu chưa được nạp
+        self.reaction_role_routes: dict[int, ReactionRoleMessageEntity] | None = None
+        # channel_id -> guild_id của các kênh đang chơi nối từ, None nếu chưa được nạp
+        self.wordchain_channels: dict[int, int] | None = None
 
     async def __fetch_reaction_role_message__(self, message_id: int, guild_id: int) -> ReactionRoleMessageEntity | None:
+        result: list = await self.database.execute_query(
+            "SELECT emoji, role_id FROM reaction_role_messages WHERE message_id = %s AND guild_id = %s",
+            (message_id, guild_id))
+        if result.__len__() == 0:
+            return None
+        entity = ReactionRoleMessageEntity(message_id, guild_id)
+        for data in result:
+            entity.map[data[0]] = data[1]
+        return entity
+
+    async def __fetch_guild__(self, guild_id: int) -> GuildEntity | None:
+        result = await self.database.execute_query("SELECT wordchain_channel_id FROM guilds WHERE guild_id = %s;", guild_id)
+        if result.__len__() == 0:
+            return None
+        entity = GuildEntity(guild_id, result[0][0])
+        result = await self.database.execute_query("SELECT message_id FROM reaction_role_messages WHERE guild_id = %s;", guild_id)
+        for data in result:
+            entity.reaction_role_messages.add(data[0])
+        return entity
+
+    async def __load_reaction_role_message__(self, message_id: int, guild_id: int) -> ReactionRoleMessageEntity | None:
         try:
-            result: list = await self.database.execute_query(
-                "SELECT emoji, role_id FROM reaction_role_messages WHERE message_id = %s AND guild_id = %s",
-                (message_id, guild_id))
-            if result.__len__() == 0:
-                return None
-            entity = ReactionRoleMessageEntity(message_id, guild_id)
-            for data in result:
-                entity.map[data[0]] = data[1]
-            return entity
+            entity = await self.__fetch_reaction_role_message__(message_id, guild_id)
         except Exception as err:
             self.logger.error(f"Truy vấn dữ liệu cho tin nhắn với ID: {message_id} thất bại\n" + repr(err))
             return None
+        # Bỏ qua kết quả nếu dữ liệu đã bị thay đổi trong lúc truy vấn
+        if self.reaction_role_message_loader.is_current(message_id):
+            if entity is None: self.reaction_role_message_negative_cache.put(message_id, True)
+            else: self.reaction_role_message_cache.put(message_id, entity.freeze())
+        return entity
 
-    async def __fetch_guild__(self, guild_id: int) -> GuildEntity | None:
+    async def __load_guild__(self, guild_id: int) -> GuildEntity | None:
         try:
-            result = await self.database.execute_query("SELECT wordchain_channel_id FROM guilds WHERE guild_id = %s;", guild_id)
-            if result.__len__() == 0:
-                return None
-            entity = GuildEntity(guild_id, result[0][0])
-            result = await self.database.execute_query("SELECT message_id FROM reaction_role_messages WHERE guild_id = %s;", guild_id)
-            for data in result:
-                entity.reaction_role_messages.add(data[0])
-            return entity
+            entity = await self.__fetch_guild__(guild_id)
         except Exception as err:
             self.logger.error(f"Truy vấn dữ liệu cho máy chủ với ID: {guild_id} thất bại\n" + repr(err))
             return None
+        # Bỏ qua kết quả nếu dữ liệu đã bị thay đổi trong lúc truy vấn
+        if self.guild_loader.is_current(guild_id):
+            if entity is None: self.guild_negative_cache.put(guild_id, True)
+            else: self.guild_cache.put(guild_id, entity.freeze())
+        return entity
 
-    async def get_guild(self, guild_id: int, create_if_not_exist: bool = True) -> GuildEntity | None:
+    def __invalidate_guild__(self, guild_id: int) -> None:
+        self.guild_cache.delete(guild_id)
+        self.guild_negative_cache.delete(guild_id)
+        self.guild_loader.forget(guild_id)
+
+    def __invalidate_reaction_role_message__(self, message_id: int) -> None:
+        self.reaction_role_message_cache.delete(message_id)
+        self.reaction_role_message_negative_cache.delete(message_id)
+        self.reaction_role_message_loader.forget(message_id)
+
+    async def __get_cached_guild__(self, guild_id: int) -> GuildEntity | None:
         try:
-            entity = self.guild_cache.get(guild_id)
+            return self.guild_cache.get(guild_id)
         except KeyError:
-            entity = await self.__fetch_guild__(guild_id)
-            self.guild_cache.put(guild_id, entity)
+            try:
+                self.guild_negative_cache.get(guild_id)
+                return None
+            except KeyError:
+                return await self.guild_loader.run(guild_id, lambda: self.__load_guild__(guild_id))
+
+    async def __get_cached_reaction_role_message__(self, message_id: int, guild_id: int) -> ReactionRoleMessageEntity | None:
+        try:
+            return self.reaction_role_message_cache.get(message_id)
+        except KeyError:
+            try:
+                self.reaction_role_message_negative_cache.get(message_id)
+                return None
+            except KeyError:
+                return await self.reaction_role_message_loader.run(
+                    message_id, lambda: self.__load_reaction_role_message__(message_id, guild_id))
+
+    async def get_guild(self, guild_id: int, create_if_not_exist: bool = True) -> GuildEntity | None:
+        "Return a mutable copy, use get_guild_view() if the entity is only read"
+        entity = await self.__get_cached_guild__(guild_id)
         if create_if_not_exist and (entity is None):
             return GuildEntity(guild_id, 0)
         return entity.copy() if entity is not None else entity
 
+    async def get_guild_view(self, guild_id: int, create_if_not_exist: bool = True) -> GuildEntity | None:
+        "Return the cached read-only entity without copying"
+        entity = await self.__get_cached_guild__(guild_id)
+        if create_if_not_exist and (entity is None):
+            return GuildEntity(guild_id, 0).freeze()
+        return entity
+
     async def get_guild_reaction_role_message(self, message_id: int, guild_id: int) -> ReactionRoleMessageEntity:
-        try:
-            entity = self.reaction_role_message_cache.get(message_id)
-        except KeyError:
-            entity = await self.__fetch_reaction_role_message__(message_id, guild_id)
-            self.guild_cache.put(message_id, entity)
+        "Return a mutable copy, use get_guild_reaction_role_message_view() if the entity is only read"
+        entity = await self.__get_cached_reaction_role_message__(message_id, guild_id)
         if entity is None:
             return ReactionRoleMessageEntity(message_id, guild_id)
-        return entity.copy() if entity is not None else entity
+        return entity.copy()
+
+    async def get_guild_reaction_role_message_view(self, message_id: int, guild_id: int) -> ReactionRoleMessageEntity:
+        "Return the cached read-only entity without copying"
+        entity = await self.__get_cached_reaction_role_message__(message_id, guild_id)
+        if entity is None:
+            return ReactionRoleMessageEntity(message_id, guild_id).freeze()
+        return entity
+
+    async def __fetch_all_reaction_role_messages__(self) -> dict[int, ReactionRoleMessageEntity]:
+        result = await self.database.execute_query("SELECT message_id, guild_id, emoji, role_id FROM reaction_role_messages;")
+        messages: dict[int, ReactionRoleMessageEntity] = {}
+        for message_id, guild_id, emoji, role_id in result:
+            entity = messages.get(message_id)
+            if entity is None:
+                entity = messages[message_id] = ReactionRoleMessageEntity(message_id, guild_id)
+            entity.map[emoji] = role_id
+        for entity in messages.values(): entity.freeze()
+        return messages
+
+    async def load_reaction_role_routes(self) -> None:
+        start = perf_counter()
+        try:
+            self.reaction_role_routes = await self.__fetch_all_reaction_role_messages__()
+        except Exception as err:
+            self.logger.error("Nạp bảng định tuyến cấp vai trò thất bại\n" + repr(err))
+            return
+        self.logger.info(
+            f"Đã nạp {self.reaction_role_routes.__len__()} tin nhắn cấp vai trò vào bảng định tuyến "
+            f"trong {(perf_counter() - start) * 1000:.1f} ms")
+
+    async def load_wordchain_channels(self) -> None:
+        try:
+            result = await self.database.execute_query(
+                "SELECT guild_id, wordchain_channel_id FROM guilds WHERE wordchain_channel_id IS NOT NULL AND wordchain_channel_id != 0;")
+        except Exception as err:
+            self.logger.error("Nạp danh sách kênh nối từ thất bại\n" + repr(err))
+            return
+        self.wordchain_channels = {channel_id: guild_id for guild_id, channel_id in result}
+        self.logger.info(f"Đã nạp {self.wordchain_channels.__len__()} kênh nối từ")
+
+    def __sync_wordchain_channel__(self, guild_id: int, channel_id: int | None) -> None:
+        if self.wordchain_channels is None: return
+        for previous_channel_id in [key for key, value in self.wordchain_channels.items() if value == guild_id]:
+            del self.wordchain_channels[previous_channel_id]
+        if channel_id: self.wordchain_channels[channel_id] = guild_id
+
+    def get_reaction_role_route(self, message_id: int) -> ReactionRoleMessageEntity | None:
+        "Only valid when reaction_role_routes is loaded"
+        return self.reaction_role_routes.get(message_id)
+
+    async def preload(self, memory_budget: int) -> None:
+        "Fill the caches with guild and reaction role data until the cache capacity or memory_budget (bytes) is reached"
+        start = perf_counter()
+        try:
+            guild_rows = await self.database.execute_query("SELECT guild_id, wordchain_channel_id FROM guilds;")
+            # Dùng lại bảng định tuyến nếu đã được nạp
+            messages = self.reaction_role_routes
+            if messages is None: messages = await self.__fetch_all_reaction_role_messages__()
+        except Exception as err:
+            self.logger.error("Nạp trước dữ liệu máy chủ thất bại\n" + repr(err))
+            return
+
+        guilds: dict[int, GuildEntity] = {}
+        for guild_id, wordchain_channel_id in guild_rows:
+            guilds[guild_id] = GuildEntity(guild_id, wordchain_channel_id)
+        for message in messages.values():
+            guild = guilds.get(message.guild_id)
+            if guild is not None: guild.reaction_role_messages.add(message.message_id)
+
+        used_memory = 0
+        loaded_guilds = 0
+        for guild in guilds.values():
+            if loaded_guilds >= self.guild_cache.capacity: break
+            size = guild.estimate_size()
+            if used_memory + size > memory_budget: break
+            self.guild_cache.put(guild.guild_id, guild.freeze())
+            used_memory += size
+            loaded_guilds += 1
+        loaded_messages = 0
+        for message in messages.values():
+            if loaded_messages >= self.reaction_role_message_cache.capacity: break
+            size = message.estimate_size()
+            if used_memory + size > memory_budget: break
+            self.reaction_role_message_cache.put(message.message_id, message.freeze())
+            used_memory += size
+            loaded_messages += 1
+
+        self.logger.info(
+            f"Đã nạp trước {loaded_guilds}/{guilds.__len__()} máy chủ và {loaded_messages}/{messages.__len__()} tin nhắn "
+            f"(~{used_memory / 1024:.1f} KiB) trong {(perf_counter() - start) * 1000:.1f} ms")
 
     async def update_guild(self, entity: GuildEntity) -> None:
         try:
-            previous = await self.get_guild(entity.guild_id, False)
+            previous = await self.get_guild_view(entity.guild_id, False)
             if previous is None:
                 await self.database.execute_update(
                     "INSERT INTO guilds (guild_id, wordchain_channel_id) VALUES (%s, %s)",
@@ -106,50 +276,51 @@ class GuildData:
             else:
                 await self.database.execute_update("UPDATE guilds SET wordchain_channel_id = %s WHERE guild_id = %s",
                                                    (entity.wordchain_channel_id, entity.guild_id))
-            self.guild_cache.delete(entity.guild_id)
+            self.__invalidate_guild__(entity.guild_id)
+            self.__sync_wordchain_channel__(entity.guild_id, entity.wordchain_channel_id)
         except Exception as err:
             self.logger.error(f"Cập nhật dữ liệu cho máy chủ với ID: {entity.guild_id} thất bại\n" + repr(err))
 
     async def update_reaction_role_message(self, entity: ReactionRoleMessageEntity) -> None:
         try:
-            guild_entity = await self.get_guild(entity.guild_id, False)
-            if guild_entity is None:
-                await self.update_guild(await self.get_guild(entity.guild_id))
-            previous: ReactionRoleMessageEntity = await self.get_guild_reaction_role_message(entity.message_id, entity.guild_id)
-            previous_key = set()
-            for key in previous.map:
-                previous_key.add(key)
-            new_key = set()
-            for key in entity.map:
-                new_key.add(key)
-
-            for key in new_key.difference(previous_key):
-                # insert new
-                await self.database.execute_update(
-                    "INSERT INTO reaction_role_messages (message_id, guild_id, emoji, role_id) VALUES (%s, %s, %s, %s)",
-                    (entity.message_id, entity.guild_id, key, entity.map[key]))
+            previous = await self.get_guild_reaction_role_message_view(entity.message_id, entity.guild_id)
+            changed = [key for key, role_id in entity.map.items() if previous.map.get(key) != role_id]
+            removed = [key for key in previous.map if key not in entity.map]
+            if changed.__len__() == 0 and removed.__len__() == 0: return
+            # Các emoji cần xoá, bao gồm cả emoji được đổi vai trò (sẽ được thêm lại bên dưới)
+            stale = removed + [key for key in changed if key in previous.map]
 
-            for key in new_key.intersection(previous_key):
-                # update exists
-                await self.database.execute_update(
-                    "UPDATE reaction_role_messages SET role_id = %s WHERE message_id = %s AND guild_id = %s AND emoji = %s",
-                    (entity.map[key], entity.message_id, entity.guild_id, key))
-
-            for key in previous_key.difference(new_key):
-                # delete
-                await self.database.execute_update(
-                    "DELETE FROM reaction_role_messages WHERE message_id = %s AND guild_id = %s AND emoji = %s ",
-                    (entity.message_id, entity.guild_id, key))
+            async with self.database.transaction() as cursor:
+                await cursor.execute(
+                    "INSERT IGNORE INTO guilds (guild_id, wordchain_channel_id) VALUES (%s, %s)", (entity.guild_id, 0))
+                if stale.__len__() > 0:
+                    await cursor.execute(
+                        "DELETE FROM reaction_role_messages WHERE message_id = %s AND guild_id = %s AND emoji IN ("
+                        + ", ".join(["%s"] * stale.__len__()) + ")",
+                        (entity.message_id, entity.guild_id, *stale))
+                if changed.__len__() > 0:
+                    await cursor.executemany(
+                        "INSERT INTO reaction_role_messages (message_id, guild_id, emoji, role_id) VALUES (%s, %s, %s, %s)",
+                        [(entity.message_id, entity.guild_id, key, entity.map[key]) for key in changed])
 
-            self.guild_cache.delete(entity.guild_id)
-            self.reaction_role_message_cache.delete(entity.message_id)
+            self.__invalidate_guild__(entity.guild_id)
+            self.__invalidate_reaction_role_message__(entity.message_id)
+            if self.reaction_role_routes is not None:
+                if entity.map.__len__() > 0: self.reaction_role_routes[entity.message_id] = entity.copy().freeze()
+                else: self.reaction_role_routes.pop(entity.message_id, None)
         except Exception as err:
             self.logger.error(f"Cập nhật dữ liệu cho tin nhắn với ID: {entity.message_id} thất bại\n" + repr(err))
 
     async def delete_guild(self, guild_id: int) -> None:
         try:
             await self.database.execute_update("DELETE FROM guilds WHERE guild_id = %s", guild_id)
-            self.guild_cache.delete(guild_id)
+            self.__invalidate_guild__(guild_id)
+            self.__sync_wordchain_channel__(guild_id, None)
+            # Các tin nhắn cấp vai trò của máy chủ bị xoá theo (ON DELETE CASCADE)
+            if self.reaction_role_routes is not None:
+                for message_id in [message_id for message_id, route in self.reaction_role_routes.items() if route.guild_id == guild_id]:
+                    del self.reaction_role_routes[message_id]
+                    self.__invalidate_reaction_role_message__(message_id)
         except Exception as err:
             self.logger.error(f"Cập nhật dữ liệu cho máy chủ với ID: {guild_id} thất bại\n" + repr(err))
 
@@ -157,7 +328,10 @@ class GuildData:
         try:
             await self.database.execute_update(
                 "DELETE FROM reaction_role_messages WHERE message_id = %s AND guild_id = %s", (message_id, guild_id,))
-            self.guild_cache.delete(guild_id)
-            self.reaction_role_message_cache.delete(message_id)
+            self.__invalidate_guild__(guild_id)
+            self.__invalidate_reaction_role_message__(message_id)
+            if self.reaction_role_routes is not None:
+                route = self.reaction_role_routes.get(message_id)
+                if route is not None and route.guild_id == guild_id: del self.reaction_role_routes[message_id]
         except Exception as err:
             self.logger.error(f"Cập nhật dữ liệu cho tin nhắn với ID: {message_id} thất bại\n" + repr(err))
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import asyncio
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import AsyncIterator
+
+
+# Các khoá có tên, dùng cho việc thống kê
+LOCK_REGISTRY: dict[str, "KeyedLock"] = {}
+
+
+class LockStatistics:
+    __slots__ = "acquired", "contended", "total_wait", "max_wait"
+
+    def __init__(self):
+        self.acquired: int = 0
+        self.contended: int = 0
+        self.total_wait: float = 0.0
+        self.max_wait: float = 0.0
+
+    def record(self, wait: float, contended: bool) -> None:
+        self.acquired += 1
+        if contended: self.contended += 1
+        self.total_wait += wait
+        if wait > self.max_wait: self.max_wait = wait
+
+    @property
+    def average_wait(self) -> float:
+        return self.total_wait / self.acquired if self.acquired else 0.0
+
+
+class KeyedLockEntry:
+    __slots__ = "lock", "users"
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users: int = 0
+
+
+class KeyedLock:
+    "One FIFO asyncio.Lock per key, removed once nobody holds or waits for it"
+
+    def __init__(self, name: str | None = None):
+        self.entries: dict[object, KeyedLockEntry] = {}
+        self.statistics = LockStatistics()
+        if name is not None: LOCK_REGISTRY[name] = self
+
+    def __release_entry__(self, key: object, entry: KeyedLockEntry) -> None:
+        entry.users -= 1
+        if entry.users == 0: del self.entries[key]
+
+    @asynccontextmanager
+    async def acquire(self, key: object) -> AsyncIterator[None]:
+        entry = self.entries.get(key)
+        if entry is None: entry = self.entries[key] = KeyedLockEntry()
+        entry.users += 1
+        contended = entry.lock.locked()
+        start = monotonic()
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            self.__release_entry__(key, entry)
+            raise
+        self.statistics.record(monotonic() - start, contended)
+        try:
+            yield
+        finally:
+            entry.lock.release()
+            self.__release_entry__(key, entry)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import disnake
+
+
+class RoleMutation:
+    __slots__ = "member_id", "role_id", "add", "enqueued_at"
+
+    def __init__(self, member_id: int, role_id: int, add: bool):
+        self.member_id = member_id
+        self.role_id = role_id
+        self.add = add
+        self.enqueued_at: float = monotonic()
+
+
+class RoleQueueStatistics:
+    __slots__ = "enqueued", "coalesced", "completed", "failed", "total_latency", "max_latency"
+
+    def __init__(self):
+        self.enqueued: int = 0
+        self.coalesced: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.total_latency: float = 0.0
+        self.max_latency: float = 0.0
+
+    def record(self, latency: float) -> None:
+        self.total_latency += latency
+        if latency > self.max_latency: self.max_latency = latency
+
+    @property
+    def average_latency(self) -> float:
+        processed = self.completed + self.failed
+        return self.total_latency / processed if processed else 0.0
+
+
+class RoleMutationQueue:
+    "Per-guild queue of role grants/removals, drained at a fixed rate by one worker per guild"
+
+    def __init__(self, bot: disnake.Client, rate: int, per: float):
+        self.logger = logging.getLogger(__name__)
+        self.bot = bot
+        self.interval: float = per / rate
+        self.pending: dict[int, OrderedDict[tuple[int, int], RoleMutation]] = {}
+        self.workers: dict[int, asyncio.Task] = {}
+        self.next_request_at: dict[int, float] = {}
+        self.statistics = RoleQueueStatistics()
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.__len__() for queue in self.pending.values())
+
+    def add_role(self, guild_id: int, member_id: int, role_id: int) -> None:
+        self.submit(guild_id, member_id, role_id, True)
+
+    def remove_role(self, guild_id: int, member_id: int, role_id: int) -> None:
+        self.submit(guild_id, member_id, role_id, False)
+
+    def submit(self, guild_id: int, member_id: int, role_id: int, add: bool) -> None:
+        queue = self.pending.get(guild_id)
+        if queue is None: queue = self.pending[guild_id] = OrderedDict()
+        key = (member_id, role_id)
+        mutation = queue.get(key)
+        if mutation is not None:
+            # Gộp với thao tác đang chờ: chỉ giữ lại trạng thái cuối cùng
+            mutation.add = add
+            self.statistics.coalesced += 1
+        else:
+            queue[key] = RoleMutation(member_id, role_id, add)
+            self.statistics.enqueued += 1
+        if guild_id not in self.workers:
+            self.workers[guild_id] = asyncio.create_task(self.__drain__(guild_id))
+
+    async def wait_until_drained(self, guild_id: int) -> None:
+        "Wait until every change queued for the guild so far has been sent. Raise CancelledError if the queue is closed first"
+        worker = self.workers.get(guild_id)
+        if worker is not None: await asyncio.shield(worker)
+
+    async def __drain__(self, guild_id: int) -> None:
+        queue = self.pending[guild_id]
+        try:
+            while queue.__len__() > 0:
+                # Không bỏ qua thao tác dựa trên vai trò trong bộ nhớ đệm: bot không nhận sự kiện cập nhật
+                # thành viên nên dữ liệu đó có thể đã cũ (ví dụ: bấm rồi bỏ bấm khi lượt cấp còn đang gửi)
+                _, mutation = queue.popitem(last=False)
+                delay = self.next_request_at.get(guild_id, 0) - monotonic()
+                if delay > 0: await asyncio.sleep(delay)
+                self.next_request_at[guild_id] = monotonic() + self.interval
+                try:
+                    if mutation.add: await self.bot.http.add_role(guild_id, mutation.member_id, mutation.role_id)
+                    else: await self.bot.http.remove_role(guild_id, mutation.member_id, mutation.role_id)
+                    self.statistics.completed += 1
+                except Exception as e:
+                    self.statistics.failed += 1
+                    self.logger.warning(
+                        f"(ID máy chủ {guild_id}): Không thể {'cấp' if mutation.add else 'xoá'} vai trò "
+                        f"{mutation.role_id} cho {mutation.member_id}\n" + repr(e))
+                self.statistics.record(monotonic() - mutation.enqueued_at)
+        finally:
+            self.pending.pop(guild_id, None)
+            self.workers.pop(guild_id, None)
+
+    async def close(self) -> None:
+        depth = self.depth
+        for worker in list(self.workers.values()): worker.cancel()
+        if depth > 0: self.logger.warning(f"Đã huỷ {depth} thao tác cấp/xoá vai trò đang chờ")